@@ -0,0 +1,187 @@
+"""
+Throughput benchmarks of the forest fire models (without and with wind) and of the Game of Life.
+
+    python benchmarks/benchmark.py run --output new.json [--sizes 25 100] [--backends numpy bits]
+    python benchmarks/benchmark.py compare baseline.json new.json [--tolerance 0.2]
+
+run times model construction, one step, compute_p, compute_cluster and a small sweep for every
+model, backend and lattice size, and saves the median times as JSON. HashLife steps are timed from
+cold memo tables ("step") and, separately, stepped again once memoized ("step (memoized)"). compare
+flags every case which got slower than the baseline by more than the tolerance, and exits with 1 if
+there is one.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for directory in [("list1",), ("list1", "ForestFire"), ("list1", "ForestFireWind"), ("list 3",)]:
+    sys.path.append(os.path.join(ROOT, *directory))
+
+import numpy as np
+import ForestFireModel as windless
+import ForestFireWind as wind
+import gameOfLife as life
+from gameOfLife import GameOfLife
+from hashLife import forget
+from sweep import run_sweep
+
+SIZES = [25, 100, 500, 1000]
+# jit only with numba installed
+FIRE_BACKENDS = [backend for backend in windless.BACKENDS if backend != "jit" or windless.JIT]
+LIFE_BACKENDS = [backend for backend in life.BACKENDS if backend != "jit" or life.JIT]
+SWEEP_SIZE = 100  # sweeps are only timed up to this size
+
+
+def measure(func, setup=None, budget=1.0, max_repeats=50):
+    """
+    Median and minimum wall time of func(setup()), repeated until budget seconds are used.
+
+    Setup is not timed. Every case runs at least once, however long it takes.
+    """
+    times = []
+    started = time.perf_counter()
+    while len(times) < max_repeats and (not times or time.perf_counter() - started < budget):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        func(arg) if setup else func()
+        times.append(time.perf_counter() - start)
+    return {"seconds": float(np.median(times)), "min": min(times), "repeats": len(times)}
+
+
+def fire_models(size):
+    # (name, module, kwargs) of the forest fire models
+    return [("ForestFire", windless, {"L": size, "p": 0.6}),
+            ("ForestFireWind", wind, {"L": size, "p": 0.6, "direction": (1, 1), "strength": 0.5})]
+
+
+def bench_fire(size, backends, budget):
+    results = []
+    for name, module, kwargs in fire_models(size):
+        for backend in backends:
+            def make(propagation="scan"):
+                return module.ForestFireModel(backend=backend, propagation=propagation, seed=1, **kwargs)
+
+            def finished():
+                model = make("front")
+                model.run_model()
+                model._cluster_sizes = None  # forget the clusters computed by the datacollector
+                return model
+
+            def clear(model):
+                model._cluster_sizes = None
+                return model
+
+            case = {"model": name, "backend": backend, "L": size}
+            results.append(dict(case, metric="construct", **measure(make, budget=budget)))
+            results.append(dict(case, metric="step", **measure(lambda model: model.step(), make, budget)))
+            done = finished()
+            results.append(dict(case, metric="compute_p", **measure(lambda: module.compute_p(done), budget=budget)))
+            results.append(dict(case, metric="compute_cluster",
+                                **measure(lambda model: module.compute_cluster(model), lambda: clear(done), budget)))
+            if size <= SWEEP_SIZE:
+                fixed = {key: value for key, value in kwargs.items() if key != "p"}
+                fixed["backend"] = backend
+
+                def sweep():
+                    run_sweep(module.ForestFireModel, {"p": [0.4, 0.6]}, fixed, 2,
+                              {"p*": module.compute_p, "Cluster": module.compute_cluster}, processes=1, seed=1)
+                results.append(dict(case, metric="sweep", **measure(sweep, budget=budget)))
+    return results
+
+
+def bench_life(size, backends, budget):
+    results = []
+    for backend in backends:
+        # HashLife needs a side which is a power of 2
+        side = 1 << (size - 1).bit_length() if backend == "hashlife" else size
+        cells = np.random.default_rng(1).random((side, side)) < .1
+
+        def make():
+            return GameOfLife(side, side, backend=backend, cells=cells)
+
+        def cold():
+            # HashLife memoizes the future of every node it has met, in any model: forget them first
+            if backend == "hashlife":
+                forget()
+            return make()
+
+        case = {"model": "GameOfLife", "backend": backend, "L": side}
+        results.append(dict(case, metric="construct", **measure(cold, budget=budget)))
+        results.append(dict(case, metric="step", **measure(lambda model: model.step(), cold, budget)))
+        if backend == "hashlife":  # the same step again, a lookup of the memoized futures
+            results.append(dict(case, metric="step (memoized)", **measure(lambda model: model.step(), make, budget)))
+    return results
+
+
+def run(args):
+    results = []
+    for size in args.sizes:
+        fire = [backend for backend in args.backends if backend in FIRE_BACKENDS]
+        life = [backend for backend in args.backends if backend in LIFE_BACKENDS]
+        for result in bench_fire(size, fire, args.budget) + bench_life(size, life, args.budget):
+            print("{model:15} {backend:8} L={L:<5} {metric:16} {seconds:.6f} s".format(**result))
+            results.append(result)
+
+    report = {"meta": {"date": datetime.now().isoformat(timespec="seconds"),
+                       "python": platform.python_version(),
+                       "numpy": np.__version__,
+                       "machine": platform.machine(),
+                       "processor": platform.processor()},
+              "results": results}
+    with open(args.output, "w") as output:
+        json.dump(report, output, indent=1)
+
+
+def compare(args):
+    def load(path):
+        with open(path) as report:
+            results = json.load(report)["results"]
+        return {(r["model"], r["backend"], r["L"], r["metric"]): r["seconds"] for r in results}
+
+    baseline, current = load(args.baseline), load(args.current)
+    regressions = 0
+    for key in sorted(set(baseline) & set(current), key=str):
+        ratio = current[key] / baseline[key] if baseline[key] > 0 else float("inf")
+        flag = ""
+        if ratio > 1 + args.tolerance:
+            flag = "REGRESSION"
+            regressions += 1
+        elif ratio < 1 / (1 + args.tolerance):
+            flag = "faster"
+        print("{:15} {:8} L={:<5} {:16} {:.6f} -> {:.6f} s  x{:.2f} {}".format(
+            *key, baseline[key], current[key], ratio, flag))
+    for key in sorted(set(baseline) ^ set(current), key=str):
+        print("{:15} {:8} L={:<5} {:16} only in {}".format(
+            *key, args.baseline if key in baseline else args.current))
+    print("{} regression(s)".format(regressions))
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("--output", default="benchmark.json")
+    run_parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    run_parser.add_argument("--backends", nargs="+", default=list(dict.fromkeys(FIRE_BACKENDS + LIFE_BACKENDS)),
+                            help="agents are slow at L >= 500, agents, numpy and jit are the forest fire "
+                                 "backends, agents, bits, sparse, hashlife and jit the Game of Life ones")
+    run_parser.add_argument("--budget", type=float, default=1.0, help="seconds spent on repeating each case")
+
+    compare_parser = commands.add_parser("compare", help="compare two results of run")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--tolerance", type=float, default=0.2,
+                                help="flag cases slower than the baseline by more than this fraction")
+
+    args = parser.parse_args()
+    if args.command == "run":
+        run(args)
+    else:
+        sys.exit(compare(args))
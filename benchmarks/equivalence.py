@@ -0,0 +1,284 @@
+"""
+Checks that the backends of every model give the same results for the same seeds, and reports their throughput.
+
+    python benchmarks/equivalence.py [--sizes 10 50] [--seeds 5] [--replicas 200] [--backends agents numpy jit]
+
+ForestFire: every backend and propagation runs the fire to its end from the same seeds; the lattice, the number
+of steps (not of static, which burns in one step), p*, Cluster and the cluster sizes must be identical.
+GameOfLife: every backend steps the same boards; the boards, populations and periods must be identical.
+ForestFireWind: numpy and jit draw the same random numbers, so both propagations of both must be identical,
+with uniform and with per-cell wind. agents draws other numbers, so over replicas seeds the burnt fraction and
+p* of every backend are compared with those of agents: a two-sample Kolmogorov-Smirnov test and a z-test of
+the means (Welch), which fail below alpha.
+
+Forks of a snapshot (and a restored model next to its original) must give the same fire whether they are
+stepped one after another or interleaved, as every model has its own random generators.
+
+Then every backend steps one bigger lattice and its steps and cells per second are reported. Exits with 1
+if a check fails; jit is left out (with a note) without numba.
+"""
+import argparse
+import math
+import os
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for directory in [("list1",), ("list1", "ForestFire"), ("list1", "ForestFireWind"), ("list 3",)]:
+    sys.path.append(os.path.join(ROOT, *directory))
+
+import numpy as np
+import ForestFireModel as windless
+import ForestFireWind as wind
+import gameOfLife as life
+from modelTools import EMPTY
+
+WIND = {"direction": (1, 1), "strength": 0.5}
+
+
+class Checks:
+    # outcome of every check, printed as it comes
+
+    def __init__(self):
+        self.failed = 0
+        self.passed = 0
+
+    def __call__(self, name, ok, detail=""):
+        if ok:
+            self.passed += 1
+        else:
+            self.failed += 1
+        print("{:4} {}{}".format("ok" if ok else "FAIL", name, "  " + detail if detail else ""))
+
+
+def backends_of(module, wanted):
+    # backends of a model module which are wanted and can run here
+    backends = [backend for backend in module.BACKENDS if wanted is None or backend in wanted]
+    if "jit" in backends and not module.JIT:
+        print("note: numba is not installed, the jit backend of {} is left out".format(module.__name__))
+        backends.remove("jit")
+    return backends
+
+
+def lattice_of(model):
+    return model.to_lattice() if model.backend == "agents" else model.lattice
+
+
+def fire_outcome(module, model):
+    # everything a finished fire reports; static burns in one step, so its steps are not compared
+    steps = None if model.propagation == "static" else model.schedule.steps
+    return (lattice_of(model).tobytes(), steps, module.compute_p(model), module.compute_cluster(model),
+            module.compute_cluster_sizes(model))
+
+
+def same(outcomes):
+    # True if all outcomes agree, steps (the second item) only where both have one
+    first = outcomes[0]
+    for outcome in outcomes[1:]:
+        for a, b in zip(first, outcome):
+            if a is not None and b is not None and a != b:
+                return False
+    return True
+
+
+def check_windless(checks, sizes, seeds, backends, p=0.6):
+    for L in sizes:
+        for seed in range(seeds):
+            outcomes = {}
+            for backend in backends:
+                for propagation in ("scan", "front", "static"):
+                    model = windless.ForestFireModel(L, p, backend=backend, propagation=propagation, seed=seed)
+                    model.run_model()
+                    outcomes[backend + "/" + propagation] = fire_outcome(windless, model)
+            checks("ForestFire L={} seed={}: {}".format(L, seed, ", ".join(outcomes)),
+                   same(list(outcomes.values())))
+
+
+def check_life(checks, sizes, seeds, backends, generations=64):
+    # sides of at least 4 (no cell is its own neighbour) rounded up to a power of 2, which hashlife needs
+    for size in sizes:
+        side = 1 << (max(size, 4) - 1).bit_length()
+        for seed in range(seeds):
+            cells = np.random.default_rng(seed).random((side, side)) < .3
+            outcomes = {}
+            for backend in backends:
+                model = life.GameOfLife(side, side, backend=backend, cells=cells, max_period=generations)
+                populations = [model.population()]
+                while model.running and model.generation < generations:
+                    model.step()
+                    populations.append(model.population())
+                outcomes[backend] = (model.cells.tobytes(), populations, model.period, model.transient)
+            checks("GameOfLife {}x{} seed={}: {}".format(side, side, seed, ", ".join(outcomes)),
+                   all(outcome == outcomes[backends[0]] for outcome in outcomes.values()))
+
+
+def check_wind_identical(checks, sizes, seeds, backends, p=0.6):
+    lattice_backends = [backend for backend in backends if backend != "agents"]
+    if len(lattice_backends) < 2:
+        return
+    for L in sizes:
+        strength = np.random.default_rng(L).random((L, L))  # per-cell wind, the same direction everywhere
+        for kind, params in (("uniform", WIND), ("per-cell", {"direction": (0, 1), "strength": strength})):
+            for seed in range(seeds):
+                outcomes = {}
+                for backend in lattice_backends:
+                    for propagation in ("scan", "front"):
+                        model = wind.ForestFireModel(L, p, backend=backend, propagation=propagation, seed=seed,
+                                                     **params)
+                        model.run_model()
+                        outcomes[backend + "/" + propagation] = fire_outcome(wind, model)
+                checks("ForestFireWind {} wind L={} seed={}: {}".format(kind, L, seed, ", ".join(outcomes)),
+                       same(list(outcomes.values())))
+
+
+def run_interleaved(models):
+    # step the models in turn until all of them have stopped
+    while any(model.running for model in models):
+        for model in models:
+            if model.running:
+                model.step()
+
+
+def check_forks(checks, L, backends, count=3, p=0.6):
+    for name, module, params in (("ForestFire", windless, {}), ("ForestFireWind", wind, WIND)):
+        for backend in backends[name]:
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, "snapshot")
+                original = module.ForestFireModel(L, p, backend=backend, propagation="scan", seed=1, **params)
+                for _ in range(3):
+                    original.step()
+                original.save(path)
+
+                alone = module.ForestFireModel.fork(path, count, seed=10)
+                for model in alone:
+                    model.run_model()
+                interleaved = module.ForestFireModel.fork(path, count, seed=10)
+                run_interleaved(interleaved)
+                checks("{} L={} {}: forks stepped one by one and interleaved".format(name, L, backend),
+                       all(fire_outcome(module, a) == fire_outcome(module, b) for a, b in zip(alone, interleaved)))
+
+                restored = module.ForestFireModel.restore(path)
+                run_interleaved([original, restored])
+                checks("{} L={} {}: restored model stepped next to its original".format(name, L, backend),
+                       fire_outcome(module, original) == fire_outcome(module, restored))
+
+
+def ks_test(a, b):
+    """
+    Two-sample Kolmogorov-Smirnov test.
+
+    :return: (largest distance between the empirical distributions, asymptotic p-value)
+    """
+    a, b = np.sort(a), np.sort(b)
+    values = np.concatenate([a, b])
+    distance = float(np.max(np.abs(np.searchsorted(a, values, side="right") / len(a) -
+                                   np.searchsorted(b, values, side="right") / len(b))))
+    n = len(a) * len(b) / (len(a) + len(b))
+    x = (math.sqrt(n) + 0.12 + 0.11 / math.sqrt(n)) * distance
+    if x < 0.2:  # the series below converges slowly, and the p-value is 1 to many digits anyway
+        return distance, 1.0
+    p = 2 * sum((-1) ** (k - 1) * math.exp(-2 * k * k * x * x) for k in range(1, 101))
+    return distance, min(max(p, 0.0), 1.0)
+
+
+def welch_test(a, b):
+    """
+    z-test of the difference of the means of two samples with their own variances (Welch).
+
+    :return: (difference of the means, two-sided p-value of the normal approximation)
+    """
+    difference = float(np.mean(a) - np.mean(b))
+    error = math.sqrt(np.var(a, ddof=1) / len(a) + np.var(b, ddof=1) / len(b))
+    if error == 0:
+        return difference, 1.0 if difference == 0 else 0.0
+    return difference, math.erfc(abs(difference) / error / math.sqrt(2))
+
+
+def check_wind_statistics(checks, L, replicas, backends, alpha, p=0.7):
+    # backends against agents (or the first one) over replicas seeds: burnt fraction and p*
+    samples = {}
+    for backend in backends:
+        burnt, percolated = [], []
+        for seed in range(replicas):
+            model = wind.ForestFireModel(L, p, backend=backend, propagation="front", seed=seed, **WIND)
+            model.run_model()
+            burnt.append(np.count_nonzero(lattice_of(model) == EMPTY) / max(model.trees, 1))
+            percolated.append(wind.compute_p(model))
+        samples[backend] = (np.array(burnt), np.array(percolated, dtype=float))
+
+    reference = backends[0]
+    for backend in backends[1:]:
+        for i, name in enumerate(("burnt fraction", "p*")):
+            a, b = samples[backend][i], samples[reference][i]
+            tests = [("Welch", welch_test(a, b))]
+            if name == "burnt fraction":  # p* takes only 0 and 1, its distribution is its mean
+                tests.append(("KS", ks_test(a, b)))
+            for test, (statistic, p_value) in tests:
+                checks("ForestFireWind L={} {} {} vs {}: {}".format(L, name, backend, reference, test),
+                       p_value >= alpha, "mean {:.4f} vs {:.4f}, statistic {:+.4f}, p-value {:.4f}".format(
+                           a.mean(), b.mean(), statistic, p_value))
+
+
+def throughput(make, cells, steps):
+    # (steps, steps per second, cells per second) of up to steps steps of a new model
+    warm = make()  # the first step compiles the jit kernels
+    warm.step()
+    model = make()
+    done = 0
+    started = time.perf_counter()
+    while model.running and done < steps:
+        model.step()
+        done += 1
+    seconds = time.perf_counter() - started
+    model.close()
+    return done, done / seconds, done * cells / seconds
+
+
+def report_throughput(sizes, steps, fire_backends, wind_backends, life_backends):
+    L, side = sizes
+    cases = [("ForestFire", backend, L, lambda backend=backend: windless.ForestFireModel(
+                 L, 0.6, backend=backend, propagation="front", seed=1)) for backend in fire_backends]
+    cases += [("ForestFireWind", backend, L, lambda backend=backend: wind.ForestFireModel(
+                  L, 0.6, backend=backend, propagation="front", seed=1, **WIND)) for backend in wind_backends]
+    cells = np.random.default_rng(1).random((side, side)) < .1
+    cases += [("GameOfLife", backend, side, lambda backend=backend: life.GameOfLife(
+                  side, side, backend=backend, cells=cells)) for backend in life_backends]
+    for name, backend, size, make in cases:
+        done, per_step, per_cell = throughput(make, size * size, steps)
+        print("{:15} {:8} L={:<5} {:5} steps {:12.1f} steps/s {:14.0f} cells/s".format(
+            name, backend, size, done, per_step, per_cell))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50], help="lattices checked for identity")
+    parser.add_argument("--seeds", type=int, default=5, help="seeds of every identity check")
+    parser.add_argument("--replicas", type=int, default=200, help="seeds of the statistical checks of the wind")
+    parser.add_argument("--wind-size", type=int, default=30, help="lattice of the statistical checks")
+    parser.add_argument("--alpha", type=float, default=0.001, help="least p-value of a statistical check")
+    parser.add_argument("--backends", nargs="+", help="only these backends (all of every model by default)")
+    parser.add_argument("--throughput", type=int, nargs=2, default=[200, 256], metavar=("L", "SIDE"),
+                        help="lattice of the forest fires and board of the Game of Life timed, 0 0 to skip")
+    parser.add_argument("--steps", type=int, default=50, help="steps timed")
+    args = parser.parse_args()
+
+    fire_backends = backends_of(windless, args.backends)
+    wind_backends = backends_of(wind, args.backends)
+    life_backends = backends_of(life, args.backends)
+    checks = Checks()
+    check_windless(checks, args.sizes, args.seeds, fire_backends)
+    check_life(checks, args.sizes, args.seeds, life_backends)
+    check_wind_identical(checks, args.sizes, args.seeds, wind_backends)
+    check_forks(checks, args.wind_size, {"ForestFire": fire_backends, "ForestFireWind": wind_backends})
+    if len(wind_backends) > 1:
+        check_wind_statistics(checks, args.wind_size, args.replicas, wind_backends, args.alpha)
+    print("{} passed, {} failed".format(checks.passed, checks.failed))
+
+    if all(args.throughput):
+        report_throughput(args.throughput, args.steps, fire_backends, wind_backends, life_backends)
+    return 1 if checks.failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,36 +1,61 @@
-from random import random
+from random import random, Random
+from collections import deque
+from time import perf_counter
+import hashlib
+import weakref
 
-from mesa import Model, Agent
-from mesa.time import SimultaneousActivation
+from mesa import Model
+from mesa.time import SimultaneousActivation, BaseScheduler
 from mesa.space import Grid
+import numpy as np
+from lifeLattice import pack, unpack, popcount, life_step, life_block, sparse_step, jit_life_step
+from modelTools import Tiles, save_snapshot, load_snapshot, JIT, NO_PHASE, Profile, Recorder
+from hashLife import build, expand, torus_step
 
+BACKENDS = ["agents", "bits", "sparse", "hashlife", "jit"]
+SOURCES = ["lifeLattice", "hashLife", "modelTools"]  # modules the results depend on, see resultCache.code_version
 
-class Cell(Agent):
 
+class Cell:
+    """Cell of the "agents" backend, x and y are read-only views of pos (see modelTools)."""
+    __slots__ = ("unique_id", "model", "pos", "state", "nextState")
 
     DEAD = 0
     ALIVE = 1
 
     def __init__(self, pos, model, init_state=DEAD):
-        super().__init__(pos, model)
-        self.x, self.y = pos
+        self.unique_id = pos
+        self.model = model
+        self.pos = pos
         self.state = init_state
         self.nextState = None
 
+    @property
+    def x(self):
+        return self.pos[0]
+
+    @property
+    def y(self):
+        return self.pos[1]
+
+    @property
+    def random(self):
+        return self.model.random
+
     @property
     def isAlive(self):
         return self.state == self.ALIVE
 
     @property
     def neighbors(self):
-        return self.model.grid.neighbor_iter((self.x, self.y), True)
+        return self.model.grid.neighbor_iter(self.pos, True)
 
     def step(self):
-        live_neighbors = sum(neighbor.isAlive for neighbor in self.neighbors)
+        live_neighbors = sum(neighbor.state for neighbor in self.neighbors)
 
         # Assume nextState is unchanged, unless changed below.
         self.nextState = self.state
-        if self.isAlive:
+        if self.state == self.ALIVE:
             if live_neighbors < 2 or live_neighbors > 3:
                 self.nextState = self.DEAD
         else:
@@ -38,26 +63,301 @@ class Cell(Agent):
                 self.nextState = self.ALIVE
 
     def advance(self):
+        if self.nextState != self.state:  # keep the model's hash of the board up to date
+            x, y = self.pos
+            self.model.state_hash ^= self.model.zobrist[x][y]
         self.state = self.nextState
 
 
 class GameOfLife(Model):
 
-    def __init__(self, height, width):
-        self.schedule = SimultaneousActivation(self)
+    def __init__(self, height, width, backend="agents", cells=None, live=None, jump=0, max_period=None,
+                 instrument=False, record=False, processes=1, packed=None):
+        """
+        :param height, width: size of the board, cell (x, y) has 0 <= x < height, 0 <= y < width
+        :param backend: "agents" - one Cell agent per location stepped by SimultaneousActivation,
+            "bits" - the board packed 64 cells per uint64 word (see lifeLattice) and stepped
+            with bitwise adder logic,
+            "sparse" - only the live cells are kept (see lifeLattice.sparse_step), memory scales
+            with the number of live cells,
+            "hashlife" - the board is a memoized quadtree (see hashLife), so repeating patterns
+            advance many generations almost for free; needs a square board with side a power of 2,
+            "jit" - the board kept as a uint8 array of Cell.DEAD/Cell.ALIVE and stepped by a loop compiled
+            with numba (an optional dependency, see lifeLattice.jit_life_step).
+            All backends give the same boards (see benchmarks/equivalence.py).
+        :param cells: optional height x width array of the initial board (truthy - ALIVE),
+            by default about 10% of cells are ALIVE, drawn in the same order by every backend.
+        :param live: optional (x, y) of the initially ALIVE cells, instead of cells
+            (a large, mostly dead board never has to be allocated)
+        :param jump: every step advances 2**jump generations
+        :param max_period: if given, the model stops (running = False) as soon as the board repeats a board
+            of at most max_period generations ago, and sets period and transient (generations before
+            the cycle starts; a still life has period 1). Boards are compared by hash: Zobrist hash
+            kept up to date by Cell.advance, digest of the packed board, or the HashLife node itself.
+            With jump > 0 boards are only compared every 2**jump generations.
+        :param instrument: if True, the model keeps a Profile of the run in profile (None otherwise,
+            which costs next to nothing)
+        :param record: if True, the model records the generation and the number of ALIVE cells after every
+            step (and at the start) in recorder, recorder.frame() returns them as a DataFrame
+        :param processes: "bits" backend only: if more than 1, the packed board is cut into that many strips
+            of rows kept in shared memory and stepped in lockstep by as many worker processes, with halos
+            wrapped around the torus (see modelTools.Tiles); the boards are the same as in one process.
+            The workers run until close.
+        :param packed: optional initial board packed as by lifeLattice.pack, instead of cells; the bits backend
+            uses it as it is, so a board mapped from a snapshot (see save and restore) is not copied
+        """
+        started = perf_counter()
+        self.random = Random()  # Mesa's generator is shared by every model of the class
+        self.profile = Profile() if instrument else None
+        self.backend = backend
+        self.running = True
+        self.height, self.width = height, width
+        self.jump = jump
+        self.generation = 0
+        self.max_period = max_period
+        self.period = None
+        self.transient = None
+        if packed is not None and backend != "bits":
+            cells, packed = unpack(packed, width), None
+        if packed is None:
+            if live is None:
+                if cells is None:
+                    cells = [[random() < .1 for y in range(width)] for x in range(height)]
+                cells = np.asarray(cells, dtype=bool).reshape(height, width)
+                live = zip(*np.nonzero(cells))
+            live = sorted((int(x), int(y)) for x, y in live)
+
+            if backend in ("agents", "bits", "jit"):
+                cells = np.zeros((height, width), dtype=bool)
+                for x, y in live:
+                    cells[x, y] = True
+        if backend != "agents":
+            self.schedule = BaseScheduler(self)
+        if processes > 1 and backend != "bits":
+            raise ValueError("processes > 1 needs the bits backend")
+        self.tiles = None
 
-        # Use a simple grid, where edges wrap around.
-        self.grid = Grid(height, width, torus=True)
+        if backend == "agents":
+            self.schedule = SimultaneousActivation(self)
 
-        # Place a cell at each location, with some initialized to
-        # ALIVE and some to DEAD.
-        for (contents, x, y) in self.grid.coord_iter():
-            cell = Cell((x, y), self)
-            if random() < .1:
-                cell.state = cell.ALIVE
-            self.grid.place_agent(cell, (x, y))
-            self.schedule.add(cell)
-        self.running = True
+            # Use a simple grid, where edges wrap around.
+            self.grid = Grid(height, width, torus=True)
+
+            # Place a cell at each location, with some initialized to
+            # ALIVE and some to DEAD.
+            for (contents, x, y) in self.grid.coord_iter():
+                pos = (x, y)
+                cell = Cell(pos, self)
+                if cells[x, y]:
+                    cell.state = cell.ALIVE
+                self.grid.place_agent(cell, pos)
+                self.schedule.add(cell)
+
+            # Zobrist hashing: random key for every location, hash of the board is XOR of keys of ALIVE cells
+            self.zobrist = [[self.random.getrandbits(64) for y in range(width)] for x in range(height)]
+            self.state_hash = 0
+            for x, y in live:
+                self.state_hash ^= self.zobrist[x][y]
+        elif backend == "bits":
+            self.packed = packed if packed is not None else pack(cells)[0]
+            if processes > 1:
+                self.tiles = Tiles(self.packed, life_block, processes, args=(width,), torus=True)
+                self.packed = self.tiles.lattice
+                weakref.finalize(self, self.tiles.close)
+        elif backend == "sparse":
+            self.live = np.array([x * width + y for x, y in live], dtype=np.int64)
+        elif backend == "hashlife":
+            level = height.bit_length() - 1
+            if height != width or height != 1 << level or level < 1:
+                raise ValueError("hashlife needs a square board with side a power of 2, got {}x{}".format(
+                    height, width))
+            self.board = build(live, level)
+        elif backend == "jit":
+            if not JIT:
+                raise ValueError("The jit backend needs numba")
+            self.lattice = cells.astype(np.uint8)
+            self._next = np.empty_like(self.lattice)  # the next generation is written here, then they swap
+        else:
+            raise ValueError("Unknown backend: " + str(backend))
+
+        # generation of each of the recent boards, by their key
+        self.seen = {}
+        self.history = deque()
+        if max_period:
+            self.detect_cycle()
+        self.recorder = None
+        if record:
+            self.recorder = Recorder(["generation", "live"])
+            self.recorder.append(self.generation, self.population())
+        if self.profile is not None:
+            self.profile.times["init"] += perf_counter() - started
+            self.profile.calls["init"] += 1
+
+    def phase(self, name):
+        return NO_PHASE if self.profile is None else self.profile.phase(name)
+
+    def save(self, path):
+        """
+        Write a snapshot of the model to path (see modelTools.save_snapshot): the packed board, parameters,
+        generation, step count, whether it runs (with period and transient) and the state of its random
+        generator. Boards seen by the cycle detection, the recorder and the profile are not saved.
+        """
+        packed = self.packed if self.backend == "bits" else pack(self.cells)[0]
+        save_snapshot(path, packed, {
+            "params": {"height": self.height, "width": self.width, "backend": self.backend, "jump": self.jump,
+                       "max_period": self.max_period},
+            "generation": self.generation, "steps": self.schedule.steps, "time": self.schedule.time,
+            "running": self.running, "period": self.period, "transient": self.transient,
+            "random": self.random.getstate()})
+
+    @classmethod
+    def restore(cls, path, **changes):
+        """
+        Model continuing from a snapshot written by save. The board is mapped copy-on-write from the file;
+        the bits backend steps it from there without reading it first. Cycle detection starts again.
+        :param changes: parameters to change from the snapshot, e.g. backend, jump or processes
+        """
+        packed, state = load_snapshot(path)
+        model = cls(**dict(state["params"], **changes), packed=packed)
+        model.generation = state["generation"]
+        model.schedule.steps = state["steps"]
+        model.schedule.time = state["time"]
+        model.running = state["running"]
+        model.period = state["period"]
+        model.transient = state["transient"]
+        version, internal, gauss = state["random"]
+        model.random.setstate((version, tuple(internal), gauss))
+        if model.max_period:
+            model.seen.clear()
+            model.history.clear()
+            model.detect_cycle()
+        return model
+
+    @classmethod
+    def fork(cls, path, count, **changes):
+        """
+        count models continuing from one snapshot, without running the generations before it again.
+
+        The rule draws no random numbers, so the continuations differ only by their changes.
+        :param changes: passed to restore
+        """
+        return [cls.restore(path, **changes) for _ in range(count)]
 
     def step(self):
-        self.schedule.step()
\ No newline at end of file
+        generations = 1 << self.jump
+        if self.profile is not None:
+            self.profile.touched.append(generations * self.cells_touched())
+
+        with self.phase("step"):
+            if self.backend == "hashlife":
+                done = 0
+                while done < generations:
+                    j = min(self.jump, self.board.level - 1, (generations - done).bit_length() - 1)
+                    self.board = torus_step(self.board, j)
+                    done += 1 << j
+            else:
+                for _ in range(generations):
+                    if self.tiles is not None:
+                        self.tiles.step()
+                        self.packed = self.tiles.lattice
+                    elif self.backend == "bits":
+                        self.packed = life_step(self.packed, self.width)
+                    elif self.backend == "sparse":
+                        self.live = sparse_step(self.live, self.height, self.width)
+                    elif self.backend == "jit":
+                        self.lattice, self._next = jit_life_step(self.lattice, self._next), self.lattice
+                    else:
+                        self.schedule.step()
+            if self.backend != "agents":
+                self.schedule.step()
+        self.generation += generations
+
+        if self.max_period:
+            self.detect_cycle()
+        if self.recorder is not None:
+            with self.phase("record"):
+                self.recorder.append(self.generation, self.population())
+
+    def close(self):
+        # stop the worker processes of processes > 1, the board is kept in this process
+        if self.tiles is not None:
+            self.packed = self.packed.copy()
+            self.tiles.close()
+            self.tiles = None
+
+    def cells_touched(self):
+        # cells one generation visits: the whole board, or the live cells and their neighbours
+        if self.backend == "sparse":
+            return 9 * len(self.live)
+        if self.backend == "hashlife":
+            return 9 * self.board.population
+        return self.height * self.width
+
+    def state_key(self):
+        # key which is equal for equal boards (up to hash collisions for the hashed backends)
+        if self.backend == "agents":
+            return self.state_hash
+        if self.backend == "hashlife":
+            return self.board  # nodes are canonical
+        if self.backend == "jit":
+            board = self.lattice
+        else:
+            board = self.packed if self.backend == "bits" else self.live
+        return hashlib.blake2b(board.tobytes(), digest_size=16).digest()
+
+    def detect_cycle(self):
+        with self.phase("cycle"):
+            self._detect_cycle()
+
+    def _detect_cycle(self):
+        key = self.state_key()
+        if key in self.seen:
+            self.transient = self.seen[key]
+            self.period = self.generation - self.transient
+            self.running = False
+            return
+
+        self.seen[key] = self.generation
+        self.history.append((self.generation, key))
+        while self.history[0][0] <= self.generation - self.max_period:
+            del self.seen[self.history.popleft()[1]]
+
+    def population(self):
+        # number of ALIVE cells
+        if self.backend == "agents":
+            return sum(cell.state for cell in self.schedule.agents)
+        if self.backend == "bits":
+            return popcount(self.packed)
+        if self.backend == "sparse":
+            return len(self.live)
+        if self.backend == "jit":
+            return int(np.count_nonzero(self.lattice))
+        return self.board.population
+
+    def live_cells(self):
+        # (x, y) of the ALIVE cells
+        if self.backend == "sparse":
+            return set(zip(*(a.tolist() for a in np.divmod(self.live, self.width))))
+        if self.backend == "hashlife":
+            return set(expand(self.board))
+        return set(zip(*(a.tolist() for a in np.nonzero(self.cells))))
+
+    @property
+    def cells(self):
+        # current board as a height x width uint8 array of Cell.DEAD/Cell.ALIVE
+        with self.phase("cells"):
+            return self._cells()
+
+    def _cells(self):
+        if self.backend == "bits":
+            return unpack(self.packed, self.width)
+        if self.backend == "jit":
+            return self.lattice.copy()
+        board = np.zeros((self.height, self.width), dtype=np.uint8)
+        if self.backend == "agents":
+            for cell in self.schedule.agents:
+                board[cell.pos] = cell.state
+        else:
+            for x, y in self.live_cells():
+                board[x, y] = Cell.ALIVE
+        return board
@@ -0,0 +1,132 @@
+from functools import lru_cache
+
+# HashLife: the board is a quadtree of canonical nodes, equal subtrees are one shared object,
+# so the future of every subtree is computed once and memoized.
+
+
+class Node:
+    __slots__ = ("level", "nw", "ne", "sw", "se", "population")
+
+    def __init__(self, level, nw, ne, sw, se, population):
+        self.level = level  # the node covers 2**level x 2**level cells
+        self.nw, self.ne, self.sw, self.se = nw, ne, sw, se  # nw - lower x and y, se - higher x and y
+        self.population = population
+
+
+DEAD = Node(0, None, None, None, None, 0)
+ALIVE = Node(0, None, None, None, None, 1)
+
+_nodes = {}
+
+
+def join(nw, ne, sw, se):
+    # the canonical node with the given quadrants
+    key = (nw, ne, sw, se)
+    node = _nodes.get(key)
+    if node is None:
+        node = Node(nw.level + 1, nw, ne, sw, se,
+                    nw.population + ne.population + sw.population + se.population)
+        _nodes[key] = node
+    return node
+
+
+@lru_cache(maxsize=None)
+def empty(level):
+    if level == 0:
+        return DEAD
+    child = empty(level - 1)
+    return join(child, child, child, child)
+
+
+def forget():
+    """
+    Drop every node and memoized future, e.g. to time HashLife from cold; nodes of existing boards are
+    no longer canonical afterwards, so only boards built after it should be stepped.
+    """
+    _nodes.clear()
+    empty.cache_clear()
+    successor.cache_clear()
+
+
+def build(live, level):
+    """
+    :param live: (x, y) of the live cells, 0 <= x, y < 2**level
+    :return: node of the given level
+    """
+    if not live:
+        return empty(level)
+    if level == 0:
+        return ALIVE
+    half = 1 << (level - 1)
+    quadrants = ([], [], [], [])
+    for x, y in live:
+        quadrants[2 * (x >= half) + (y >= half)].append((x % half, y % half))
+    return join(*(build(quadrant, level - 1) for quadrant in quadrants))
+
+
+def expand(node, x=0, y=0):
+    # (x, y) of the live cells of the node placed at (x, y)
+    if node.population == 0:
+        return
+    if node.level == 0:
+        yield x, y
+        return
+    half = 1 << (node.level - 1)
+    yield from expand(node.nw, x, y)
+    yield from expand(node.ne, x, y + half)
+    yield from expand(node.sw, x + half, y)
+    yield from expand(node.se, x + half, y + half)
+
+
+def _life_4x4(node):
+    # centre 2x2 of a level 2 node after one generation
+    cells = [[0] * 4 for _ in range(4)]
+    for x, y in expand(node):
+        cells[x][y] = 1
+    result = []
+    for x in (1, 2):
+        for y in (1, 2):
+            neighbours = sum(cells[i][j] for i in (x - 1, x, x + 1) for j in (y - 1, y, y + 1)) - cells[x][y]
+            alive = neighbours == 3 or (neighbours == 2 and cells[x][y])
+            result.append(ALIVE if alive else DEAD)
+    return join(*result)
+
+
+@lru_cache(maxsize=None)
+def successor(node, j):
+    """
+    Centre of the node (one level down) after 2**j generations, j <= node.level - 2.
+
+    The node is cut into nine overlapping subnodes one level down, whose centres are advanced
+    recursively and joined again; advancing them twice gives the full 2**(level-2) generations.
+    """
+    if node.population == 0:
+        return node.nw
+    if node.level == 2:
+        return _life_4x4(node)
+
+    a, b, c, d = node.nw, node.ne, node.sw, node.se
+    parts = [join(a.nw, a.ne, a.sw, a.se), join(a.ne, b.nw, a.se, b.sw), join(b.nw, b.ne, b.sw, b.se),
+             join(a.sw, a.se, c.nw, c.ne), join(a.se, b.sw, c.ne, d.nw), join(b.sw, b.se, d.nw, d.ne),
+             join(c.nw, c.ne, c.sw, c.se), join(c.ne, d.nw, c.se, d.sw), join(d.nw, d.ne, d.sw, d.se)]
+
+    if j < node.level - 2:
+        # the subnodes already advance far enough, only their centres are needed
+        c1, c2, c3, c4, c5, c6, c7, c8, c9 = [successor(part, j) for part in parts]
+        return join(join(c1.se, c2.sw, c4.ne, c5.nw), join(c2.se, c3.sw, c5.ne, c6.nw),
+                    join(c4.se, c5.sw, c7.ne, c8.nw), join(c5.se, c6.sw, c8.ne, c9.nw))
+
+    c1, c2, c3, c4, c5, c6, c7, c8, c9 = [successor(part, j - 1) for part in parts]
+    return join(successor(join(c1, c2, c4, c5), j - 1), successor(join(c2, c3, c5, c6), j - 1),
+                successor(join(c4, c5, c7, c8), j - 1), successor(join(c5, c6, c8, c9), j - 1))
+
+
+def torus_step(board, j):
+    """
+    Advance a square torus of side 2**board.level by 2**j generations, j <= board.level - 1.
+
+    Four copies of the board are the periodic plane around it; the centre of that node is the board
+    rolled by half of its side, so swapping the quadrants of the result rolls it back.
+    """
+    rolled = successor(join(board, board, board, board), j)
+    return join(rolled.se, rolled.sw, rolled.ne, rolled.nw)
@@ -0,0 +1,156 @@
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "list1"))
+from modelTools import jit
+
+# Bit-packed board of the "bits" backend: row x of the board is one row of uint64 words,
+# cell y is bit y % 64 of word y // 64. Bits past the width in the last word are always 0.
+
+ONE = np.uint64(1)
+TOP = np.uint64(63)
+
+
+def pack(cells):
+    """
+    :param cells: 2-D array, truthy cells are alive
+    :return: (packed words, width)
+    """
+    rows, width = cells.shape
+    words = -(-width // 64)
+    padded = np.zeros((rows, words * 64), dtype=np.uint8)
+    padded[:, :width] = np.asarray(cells) != 0
+    return np.packbits(padded, axis=1, bitorder="little").view("<u8").astype(np.uint64), width
+
+
+def unpack(packed, width):
+    # 2-D uint8 array of 0/1 from packed words
+    bits = np.unpackbits(packed.astype("<u8").view(np.uint8), axis=1, bitorder="little")
+    return bits[:, :width]
+
+
+def popcount(packed):
+    # number of set bits (live cells) of packed words
+    return int(np.count_nonzero(np.unpackbits(packed.astype("<u8").view(np.uint8))))
+
+
+def roll_right(packed, width):
+    # cell y gets the value of cell y - 1, cell 0 gets the value of cell width - 1
+    last, bit = divmod(width - 1, 64)
+    wrapped = (packed[:, last] >> np.uint64(bit)) & ONE
+    out = packed << ONE
+    out[:, 1:] |= packed[:, :-1] >> TOP
+    out[:, 0] |= wrapped
+    out[:, last] &= ~(~np.uint64(0) << np.uint64(bit) << ONE)  # drop the bit pushed past the width
+    return out
+
+
+def roll_left(packed, width):
+    # cell y gets the value of cell y + 1, cell width - 1 gets the value of cell 0
+    last, bit = divmod(width - 1, 64)
+    wrapped = packed[:, 0] & ONE
+    out = packed >> ONE
+    out[:, :-1] |= packed[:, 1:] << TOP
+    out[:, last] &= ~(ONE << np.uint64(bit))
+    out[:, last] |= wrapped << np.uint64(bit)
+    return out
+
+
+def life_step(packed, width, block=256):
+    """
+    One B3/S23 generation on a torus, 64 cells per bitwise operation.
+
+    Each row first sums its horizontal neighbours with bitwise adders: left + cell + right into
+    two bits for the rows above and below, left + right for the row itself. The three 2-bit sums
+    are then added into a 3-bit count of neighbours; counting modulo 8 is enough, because
+    8 neighbours is neither 2 nor 3. Rows are processed in blocks, so the temporaries stay in cache.
+    :return: new packed board
+    """
+    rows = packed.shape[0]
+    out = np.empty_like(packed)
+    for start in range(0, rows, block):
+        stop = min(start + block, rows)
+        # the block with one row above and below, wrapped around the torus
+        halo = packed.take(np.arange(start - 1, stop + 1) % rows, axis=0)
+        out[start:stop] = _life_block(halo, width)
+    return out
+
+
+def _life_block(halo, width):
+    # next generation of halo[1:-1], the first and the last row only provide neighbours
+    left = roll_left(halo, width)
+    right = roll_right(halo, width)
+
+    m0 = left ^ right  # left + right
+    m1 = left & right
+    h0 = m0 ^ halo  # left + cell + right
+    h1 = m1 | (m0 & halo)
+
+    u0, u1 = h0[:-2], h1[:-2]
+    d0, d1 = h0[2:], h1[2:]
+    m0, m1 = m0[1:-1], m1[1:-1]
+
+    # bit 0 of the count and its carry
+    t0 = u0 ^ d0
+    c0 = (u0 & d0) | (t0 & m0)
+    t0 ^= m0
+    # bits 1 and 2 of the count: u1 + d1 + m1 + c0
+    x = u1 ^ d1
+    y = m1 ^ c0
+    t1 = x ^ y
+    t2 = (u1 & d1) ^ (m1 & c0) ^ (x & y)
+
+    # alive next generation: 3 neighbours, or 2 neighbours and alive now
+    t0 |= halo[1:-1]
+    t0 &= t1
+    t0 &= ~t2
+    return t0
+
+
+def life_block(halo, out, rng, width):
+    # life_step of the packed rows halo[1:-1] written to out, for Tiles
+    out[:] = _life_block(halo, width)
+    return 0
+
+
+def sparse_step(live, height, width):
+    """
+    One B3/S23 generation on a torus, keeping only the live cells.
+
+    :param live: sorted flat indices (x * width + y) of the live cells
+    :return: sorted flat indices of the live cells of the next generation
+    """
+    x, y = np.divmod(live, width)
+    neighbours = np.concatenate([((x + dx) % height) * width + (y + dy) % width
+                                 for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy])
+    cells, counts = np.unique(neighbours, return_counts=True)
+    alive = np.isin(cells, live, assume_unique=True)
+    return cells[(counts == 3) | ((counts == 2) & alive)]
+
+
+def _jit_life(board, out):
+    # compiled by jit_life_step: column sums of three rows, the count of a cell is that of its 3 x 3 block
+    height, width = board.shape
+    sums = np.empty(width + 2, dtype=np.uint8)  # sums[y + 1]: column y, wrapped around at both ends
+    for x in range(height):
+        above, row, below = board[x - 1 if x else height - 1], board[x], board[x + 1 if x + 1 < height else 0]
+        for y in range(width):
+            sums[y + 1] = above[y] + row[y] + below[y]
+        sums[0], sums[width + 1] = sums[width], sums[1]
+        for y in range(width):
+            count = sums[y] + sums[y + 1] + sums[y + 2] - row[y]
+            out[x, y] = 1 if count == 3 or (count == 2 and row[y]) else 0
+
+
+def jit_life_step(board, out):
+    """
+    One B3/S23 generation on a torus of a uint8 board of 0/1, one cell at a time in a loop compiled by numba.
+
+    :param out: array of the shape of board the next generation is written to
+    :return: out
+    """
+    jit(_jit_life)(board, out)
+    return out
+
+
@@ -1,6 +1,11 @@
+import os
+import sys
 from mesa.visualization.modules import CanvasGrid
 from mesa.visualization.ModularVisualization import ModularServer
 from gameOfLife import GameOfLife
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "viewer"))
+from frames import LIFE_COLOURS
+from streamServer import StreamServer
 
 
 def agent_portrayal(agent):
@@ -20,13 +25,18 @@ def agent_portrayal(agent):
 height = 100
 width = 100
 
-# Make a world that is 50x50, on a 250x250 display.
-grid = CanvasGrid(agent_portrayal, height, width, 500, 500)
+if "--stream" in sys.argv:
+    # binary frames of the board instead of portrayals, keeps up with big boards (see viewer/streamServer)
+    server = StreamServer(GameOfLife, {"height": 1024, "width": 1024, "backend": "bits"}, LIFE_COLOURS,
+                          "Game of life")
+else:
+    # Make a world that is 50x50, on a 250x250 display.
+    grid = CanvasGrid(agent_portrayal, height, width, 500, 500)
 
-server = ModularServer(GameOfLife,
-                       [grid],
-                       "Game of life",
-                       {"height": height, "width": width})
+    server = ModularServer(GameOfLife,
+                           [grid],
+                           "Game of life",
+                           {"height": height, "width": width})
 
 server.port = 8521  # The default
 server.launch()
@@ -1,125 +1,451 @@
-from mesa import Agent, Model
-from mesa.time import SimultaneousActivation
+from mesa import Model
+from mesa.time import SimultaneousActivation, BaseScheduler
 from mesa.space import Grid
 from mesa.datacollection import DataCollector
 from collections import Counter
+from random import Random
+from time import perf_counter
+import weakref
+import numpy as np
+from fireLattice import draw_forest, burn_step, burn_block, front_step, burn_out, jit_front_step
+from modelTools import NO_TREE, OCCUPIED, BURNING, EMPTY, STATUS, CODE, cluster_sizes, count_unburnt, \
+    count_perimeter, Tiles, save_snapshot, load_snapshot, JIT, NO_PHASE, Profile, Recorder, timed
 
+BACKENDS = ["agents", "numpy", "jit"]
+SOURCES = ["fireLattice", "modelTools"]  # modules the results depend on, see resultCache.code_version
 
-class TreeAgent(Agent):
-    def __init__(self, id, model, status):
-        super().__init__(id, model)
-        self.status = status
-        self.changed = 0
+
+class TreeAgent:
+    """Tree of the "agents" backend, status is a read-only view of its lattice code (see modelTools)."""
+    __slots__ = ("unique_id", "model", "pos", "code", "changed", "cluster")
+
+    def __init__(self, id, model, code):
+        self.unique_id = id
+        self.model = model
+        self.pos = None
+        self.code = code
+        self.changed = False
         self.cluster = None
 
+    @property
+    def status(self):
+        return STATUS[self.code]
+
+    @property
+    def random(self):
+        return self.model.random
+
     def step(self):  # function performed at the model step
-        if self.status == "burning":
-            self.changed = 1
-        elif self.status == "occupied":
+        if self.code == BURNING:
+            self.changed = True
+        elif self.code == OCCUPIED:
             neighbours = self.model.grid.get_neighbors(
                 self.pos,
                 moore=True,
                 include_center=False)
 
             for agent in neighbours:
-                if agent.status == "burning":
-                    self.changed = 1
+                if agent.code == BURNING:
+                    self.changed = True
                     break
 
     def advance(self):  # function performed after step() function
-        if self.changed == 1:
-            if self.status == "burning":
-                self.status = "empty"
-                self.changed = 0
-            elif self.status == "occupied":
-                self.status = "burning"
-                self.changed = 0
+        if self.changed:
+            self.code = EMPTY if self.code == BURNING else BURNING
+            self.changed = False
 
 
 class ForestFireModel(Model):
-    def __init__(self, L, p):
+    def __init__(self, L, p, backend="agents", propagation="scan", seed=None, instrument=False,
+                 record=False, processes=1, lattice=None):
+        """
+        :param L: size of model's grid
+        :param p: probability of tree's occurrence in a cell
+        :param backend: "agents" - one TreeAgent per tree stepped by SimultaneousActivation,
+            "numpy" - the whole forest kept in one uint8 array (see fireLattice) and stepped
+            with a vectorized Moore-neighbourhood update,
+            "jit" - the lattice of "numpy" stepped by a loop compiled with numba (an optional dependency,
+            see fireLattice.jit_front_step). It has no scan, "scan" is taken as "front".
+        :param propagation: "scan" - every step visits the whole forest,
+            "front" - every step visits only the burning trees and their neighbours, and the number
+            of burning trees is kept up to date instead of being searched for,
+            "static" - the first step burns, in one labelling pass, every tree Moore-connected to
+            the burning row (which is exactly what the fire reaches) and ends the run. Only the
+            step count differs from the other modes, so this is the fast way to sweep compute_p.
+            The jit backend runs "scan" as "front" (propagation is then "front"), which gives the same results.
+        :param seed: seed of the model's random generator
+        :param instrument: if True, the model keeps a Profile of the run in profile (None otherwise,
+            which costs next to nothing); compute_profile reports it
+        :param record: if True, the model records every step (and the start) in recorder: step, the number of
+            burning, occupied and burnt trees, front (occupied trees next to a burning one) and rows reached
+            (rows from L-1 down to the lowest one the fire has got to, L when it percolates);
+            compute_steps returns them as a DataFrame
+        :param processes: numpy backend with scan propagation only: if more than 1, the lattice is cut into
+            that many strips of rows kept in shared memory and stepped in lockstep by as many worker
+            processes (see modelTools.Tiles), for a single lattice too large for one core. The results
+            are the same as in one process. The workers stop when the fire dies (or on close).
+        :param lattice: optional L x L array of lattice codes (see fireLattice) to start from instead of
+            drawing a forest, e.g. a snapshot (see save and restore)
+
+        All backends draw the same forest for the same seed (in one call, see fireLattice.draw_forest),
+        so they give the same results (see benchmarks/equivalence.py). The numpy and jit backends make no
+        TreeAgents unless grid is used, e.g. by the CanvasGrid of the visualization.
+        """
+        started = perf_counter()
         super().__init__()
-        self.grid = Grid(L, L, False)
-        self.schedule = SimultaneousActivation(self)
+        self.random = Random(seed)  # Mesa's generator is shared by every model of the class
+        self.profile = Profile() if instrument else None
         self.running = True
+        self.L = L
         self.p = p
+        self.backend = backend
+        if propagation not in ("scan", "front", "static"):
+            raise ValueError("Unknown propagation: " + str(propagation))
+        if backend == "jit" and propagation == "scan":  # the jit kernels only step the front
+            propagation = "front"
+        self.propagation = propagation
+
+        # the forest is drawn in one call by a generator seeded from the model's one
+        self.rng = np.random.default_rng(self.random.getrandbits(64))
+        if lattice is None:
+            lattice = draw_forest(L, p, self.rng)
+        self.trees = int(np.count_nonzero(lattice))
+        self._grid = None
+        if backend == "agents":
+            self.schedule = SimultaneousActivation(self)
+            self._grid = Grid(L, L, False)
+            for tree in self.make_agents(lattice):
+                self.schedule.add(tree)
+            self.front = [tree for tree in self.schedule.agents if tree.code == BURNING]
+        elif backend in ("numpy", "jit"):
+            if backend == "jit" and not JIT:
+                raise ValueError("The jit backend needs numba")
+            self.schedule = BaseScheduler(self)
+            self.lattice = lattice
+            self.front = np.nonzero(self.lattice == BURNING)
+        else:
+            raise ValueError("Unknown backend: " + str(backend))
 
-        for i in range(L):
-            for j in range(L):
-                if self.random.random() <= self.p:
-                    if i == L-1:
-                        tree = TreeAgent((i, j), self, "burning")
-                    else:
-                        tree = TreeAgent((i, j), self, "occupied")
-                    self.schedule.add(tree)
-                    self.grid.place_agent(tree, (i, j))
+        self.tiles = None
+        if processes > 1:
+            if backend != "numpy" or propagation != "scan":
+                raise ValueError("processes > 1 needs the numpy backend with scan propagation")
+            self.tiles = Tiles(self.lattice, burn_block, processes)
+            self.lattice = self.tiles.lattice
+            weakref.finalize(self, self.tiles.close)
 
         self.datacollector = DataCollector(
             model_reporters={"p*": compute_p, "Cluster": compute_cluster})
+        self.recorder = None
+        if record:
+            self.recorder = Recorder(["step", "burning", "occupied", "burnt", "front", "rows reached"])
+            self.record()
+        if self.profile is not None:
+            self.profile.times["init"] += perf_counter() - started
+            self.profile.calls["init"] += 1
+
+    def phase(self, name):
+        return NO_PHASE if self.profile is None else self.profile.phase(name)
+
+    @property
+    def grid(self):
+        # Grid of the TreeAgents; the numpy and jit backends make them from the lattice only when something
+        # (e.g. the CanvasGrid of the visualization) first asks for them, and keeps them up to date
+        if self._grid is None:
+            self._grid = Grid(self.L, self.L, False)
+            self.make_agents(self.lattice)
+            self._shown = self.lattice.copy()
+        return self._grid
+
+    def make_agents(self, lattice):
+        # one TreeAgent per tree of the lattice placed on the grid, row by row, return them
+        trees = []
+        for i, j in zip(*(a.tolist() for a in np.nonzero(lattice))):
+            tree = TreeAgent((i, j), self, int(lattice[i, j]))
+            self._grid.place_agent(tree, (i, j))
+            trees.append(tree)
+        return trees
+
+    def sync_agents(self):
+        # numpy and jit backends: copy the statuses of the changed cells of the lattice to their agents
+        for i, j in zip(*(a.tolist() for a in np.nonzero(self.lattice != self._shown))):
+            self._grid[i][j].code = int(self.lattice[i, j])
+        self._shown = self.lattice.copy()
+
+    def save(self, path):
+        """
+        Write a snapshot of the model to path (see modelTools.save_snapshot): its lattice, parameters,
+        step count, whether it runs and the states of both random generators. The recorder and the profile
+        are not saved.
+        """
+        lattice = self.to_lattice() if self.backend == "agents" else self.lattice
+        save_snapshot(path, lattice, {
+            "params": {"L": self.L, "p": self.p, "backend": self.backend, "propagation": self.propagation},
+            "steps": self.schedule.steps, "time": self.schedule.time, "running": self.running,
+            "random": self.random.getstate(), "rng": self.rng.bit_generator.state})
+
+    @classmethod
+    def restore(cls, path, **changes):
+        """
+        Model continuing from a snapshot written by save, as the saved one would have gone on.
+
+        The lattice is mapped copy-on-write from the file, so nothing is read until it is used and the
+        file is never changed.
+        :param changes: parameters to change from the snapshot, e.g. processes; with seed the random
+            generators start from it instead of their saved states
+        """
+        lattice, state = load_snapshot(path)
+        model = cls(**dict(state["params"], **changes), lattice=lattice)
+        model.schedule.steps = state["steps"]
+        model.schedule.time = state["time"]
+        model.running = state["running"]
+        if model.recorder is not None:  # its first row was recorded before the steps were restored
+            model.recorder.size = 0
+            model.record()
+        if "seed" not in changes:
+            version, internal, gauss = state["random"]
+            model.random.setstate((version, tuple(internal), gauss))
+            model.rng.bit_generator.state = state["rng"]
+        return model
+
+    @classmethod
+    def fork(cls, path, count, seed=None, **changes):
+        """
+        count models continuing from one snapshot, without running the steps before it again.
+
+        Every continuation has its own random generators, seeded with seed, seed + 1, ... (or at random),
+        so they diverge only where their changes differ (the fire draws no random numbers).
+        :param changes: passed to restore
+        """
+        return [cls.restore(path, seed=None if seed is None else seed + i, **changes) for i in range(count)]
 
     def step(self):
-        self.schedule.step()
+        if self.profile is not None:
+            self.profile.touched.append(self.cells_touched())
+
+        burning = True
+        with self.phase("step"):
+            if self.propagation == "static":
+                burning = self.static_step()
+            elif self.propagation == "front":
+                burning = self.front_step()
+            elif self.tiles is not None:
+                burning = self.tiles.step()
+                self.lattice = self.tiles.lattice
+                self.schedule.step()
+            elif self.backend == "numpy":
+                burning = burn_step(self.lattice)
+                self.schedule.step()
+            else:
+                self.schedule.step()
+        if self.backend != "agents" and self._grid is not None:
+            self.sync_agents()
+        if self.propagation == "scan" and self.backend == "agents":
+            with self.phase("scan"):
+                burning = self.exists_status("burning")
+        if self.recorder is not None:
+            with self.phase("record"):
+                self.record()
 
-        if not self.exists_status("burning"):
-            self.datacollector.collect(self)
+        if not burning:
+            self.close()
+            with self.phase("reporters"):
+                self.datacollector.collect(self)
             self.running = False
 
+    def close(self):
+        # stop the worker processes of processes > 1, the lattice is kept in this process
+        if self.tiles is not None:
+            self.lattice = self.lattice.copy()
+            self.tiles.close()
+            self.tiles = None
+
+    def cells_touched(self):
+        # cells the next step visits: the burning trees and their neighbours, or the whole forest
+        if self.propagation == "front":
+            return 9 * len(self.front if self.backend == "agents" else self.front[0])
+        if self.backend == "agents" and self.propagation == "scan":
+            return self.schedule.get_agent_count()
+        return self.L * self.L
+
+    def front_step(self):  # step only the burning trees and their neighbours, return number of burning trees
+        if self.backend == "jit":
+            self.front = jit_front_step(self.lattice, self.front)
+            self.schedule.step()
+            return len(self.front[0])
+        if self.backend == "numpy":
+            self.front = front_step(self.lattice, self.front)
+            self.schedule.step()
+            return len(self.front[0])
+
+        neighbours = {}
+        for tree in self.front:
+            for agent in self.grid.get_neighbors(tree.pos, moore=True, include_center=False):
+                if agent.code == OCCUPIED:
+                    neighbours[agent.pos] = agent
+        # keep the order of the schedule, in which the scan visits the trees
+        touched = self.front + [neighbours[pos] for pos in sorted(neighbours)]
+        for tree in touched:
+            tree.step()
+        for tree in touched:
+            tree.advance()
+        self.schedule.steps += 1
+        self.schedule.time += 1
+
+        self.front = [tree for tree in touched if tree.code == BURNING]
+        return len(self.front)
+
+    def to_lattice(self):
+        # agents backend: the forest as a lattice of codes (see fireLattice)
+        lattice = np.full((self.L, self.L), NO_TREE, dtype=np.uint8)
+        for tree in self.schedule.agents:
+            lattice[tree.pos] = tree.code
+        return lattice
+
+    def static_step(self):  # burn everything the fire would reach, return number of burning trees (0)
+        if self.backend != "agents":
+            burn_out(self.lattice)
+        else:
+            lattice = self.to_lattice()
+            burn_out(lattice)
+            for tree in self.schedule.agents:
+                tree.code = int(lattice[tree.pos])
+        self.schedule.steps += 1
+        self.schedule.time += 1
+        return 0
+
+    def record(self):
+        # append the forest after the last step (or at the start) to the recorder
+        if self.propagation == "static" and self.schedule.steps:  # everything burnt in one step
+            lattice = self.to_lattice() if self.backend == "agents" else self.lattice
+            counts = np.bincount(lattice.ravel(), minlength=4)
+            rows = np.nonzero(lattice == EMPTY)[0]
+            self.recorder.append(self.schedule.steps, counts[BURNING], counts[OCCUPIED], counts[EMPTY], 0,
+                                 self.L - rows.min() if len(rows) else 0)
+            return
+
+        if self.backend != "agents":
+            front = self.front if self.propagation == "front" else np.nonzero(self.lattice == BURNING)
+            rows = front[0]
+            perimeter = count_perimeter(self.lattice, front)
+        else:
+            if self.propagation == "front":
+                burning = self.front
+            else:
+                burning = [tree for tree in self.schedule.agents if tree.code == BURNING]
+            rows = [tree.pos[0] for tree in burning]
+            perimeter = len({agent.pos for tree in burning
+                             for agent in self.grid.get_neighbors(tree.pos, moore=True, include_center=False)
+                             if agent.code == OCCUPIED})
+
+        if self.recorder.size:  # every tree burns for one step, so the burnt ones are counted as they go
+            burnt = self.recorder.last("burnt") + self.recorder.last("burning")
+            reached = self.recorder.last("rows reached")
+        else:  # the start, or a restored snapshot: count what has burnt so far
+            burnt_rows = np.nonzero((self.to_lattice() if self.backend == "agents" else self.lattice) == EMPTY)[0]
+            burnt = len(burnt_rows)
+            reached = self.L - int(burnt_rows.min()) if burnt else 0
+        if len(rows):
+            reached = max(reached, self.L - int(np.min(rows)))
+        self.recorder.append(self.schedule.steps, len(rows), self.trees - len(rows) - burnt, burnt, perimeter,
+                             reached)
+
     def exists_status(self, status):  # function to check is exist any tree which has some status
+        code = CODE[status]
         for tree in self.schedule.agents:
-            if tree.status == status:
+            if tree.code == code:
                 return True
 
 
-
+@timed
 def compute_p(model):
+    if model.backend != "agents":
+        return int(np.any(model.lattice[0] == EMPTY))
     for agent in model.schedule.agents:
-        if agent.pos[0] == 0 and agent.status == "empty":
+        if agent.pos[0] == 0 and agent.code == EMPTY:
             return 1
     return 0
 
 
+@timed
 def compute_cluster(model):
-    # Get sorted list of agents
-    agents = sorted([agent for agent in model.schedule.agents], key=lambda tup: (tup.pos[0], tup.pos[1]))
+    sizes = compute_cluster_sizes(model)
+    # trees which have not burnt keep cluster None and are counted together, as one more "cluster"
+    if model.backend != "agents":
+        unburnt = count_unburnt(model.lattice)
+    else:
+        unburnt = sum(1 for agent in model.schedule.agents if agent.cluster is None)
+    return max(sizes + [unburnt])
 
-    largestLabel = 0
 
-    for agent in agents:
-        if agent.status == "empty":  # if agent was burned
-            neighbours = model.grid.get_neighbors(
-                agent.pos,
-                moore=False,
-                include_center=False)
-            neighboursDict = {x.pos: x for x in neighbours}
+@timed
+def compute_cluster_sizes(model):
+    """
+    Sizes of all clusters of burnt trees (neighbours: left and below), from the largest.
 
-            # Get left and below neighbour, if one of them not exists set as None
-            if (agent.pos[0] - 1, agent.pos[1]) in list(neighboursDict.keys()):
-                left = neighboursDict.get((agent.pos[0] - 1, agent.pos[1]))
-            else:
-                left = None
-            if (agent.pos[0], agent.pos[1] - 1) in list(neighboursDict.keys()):
-                below = neighboursDict.get((agent.pos[0], agent.pos[1] - 1))
-            else:
-                below = None
-
-            if not left and not below:  # If considered neighbours not exists
-                largestLabel += 1
-                agent.cluster = largestLabel  # set new cluster
-            elif left and not below:  # If left exists and below not exists
-                agent.cluster = left.cluster  # set the same cluster to agent as in left neighbour
-            elif not left and below:  # If below exists and left not exists
-                agent.cluster = below.cluster  # set the same cluster to agent as in below neighbour
-            elif left and below:  # If both of them exists
-                minCluster = min(left.cluster, below.cluster)
-                maxCluster = max(left.cluster, below.cluster)
-                agent.cluster = minCluster  # set agent's cluster as minimum of left and below clusters
-                for temp in agents:  # and change cluster for every agent whose have maximum cluster
-                    if temp.cluster == maxCluster:
-                        temp.cluster = minCluster
-
-    clusters = [agent.cluster for agent in agents]
-    biggest = Counter(clusters)
-    if biggest:  # if there is any cluster
-        return max(list(biggest.values()))
+    Clusters are labelled in one pass with union-find (Hoshen-Kopelman), so merging two labels
+    costs almost nothing. The result is kept on the model until the next step, so reporting both
+    compute_cluster and compute_cluster_sizes labels the forest only once.
+    """
+    cached = getattr(model, "_cluster_sizes", None)
+    if cached is not None and cached[0] == model.schedule.steps:
+        return list(cached[1])
+
+    if model.backend != "agents":
+        sizes = cluster_sizes(model.lattice)
     else:
-        return 0
+        sizes = label_agents(model)
+
+    model._cluster_sizes = (model.schedule.steps, sizes)
+    return list(sizes)
+
+
+def label_agents(model):
+    # Set cluster of every burned agent, return sizes of the clusters
+    parent = []  # parent[label] - label which label was merged into, label is a root if parent[label] == label
+
+    def find(label):
+        root = label
+        while parent[root] != root:
+            root = parent[root]
+        while parent[label] != root:  # path compression
+            parent[label], label = root, parent[label]
+        return root
+
+    labels = {}
+    for agent in sorted(model.schedule.agents, key=lambda tup: (tup.pos[0], tup.pos[1])):
+        agent.cluster = None
+        if agent.code == EMPTY:  # if agent was burned
+            # Get labels of left and below neighbour, None if the neighbour isn't a burned tree
+            left = labels.get((agent.pos[0] - 1, agent.pos[1]))
+            below = labels.get((agent.pos[0], agent.pos[1] - 1))
+
+            if left is None and below is None:  # If considered neighbours don't exist
+                label = len(parent)  # set new cluster
+                parent.append(label)
+            elif below is None:
+                label = find(left)
+            elif left is None:
+                label = find(below)
+            else:  # If both of them exist, merge the larger label into the smaller one
+                left, below = find(left), find(below)
+                label = min(left, below)
+                parent[max(left, below)] = label
+            labels[agent.pos] = label
+
+    sizes = Counter()
+    for agent in model.schedule.agents:
+        if agent.pos in labels:
+            agent.cluster = find(labels[agent.pos]) + 1
+            sizes[agent.cluster] += 1
+    return sorted(sizes.values(), reverse=True)
+
+
+def compute_profile(model):
+    # Profile.summary of an instrumented model (instrument=True), None otherwise
+    return None if model.profile is None else model.profile.summary()
+
+
+def compute_steps(model):
+    # DataFrame of the steps recorded by the model (record=True), None otherwise
+    return None if model.recorder is None else model.recorder.frame()
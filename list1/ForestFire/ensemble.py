@@ -0,0 +1,64 @@
+import os
+import sys
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from modelTools import NO_TREE, OCCUPIED, BURNING, EMPTY, moore_any, cluster_sizes, count_unburnt
+
+
+def run_ensemble(L, p, iterations, max_steps=1000, seed=None):
+    """
+    Run all replicas of the windless ForestFireModel (numpy backend) for one or more p values at once.
+
+    The forests are stacked into one (replicas, L, L) uint8 tensor and every step advances all
+    of them with one vectorized update. A replica whose fire has died is scored and dropped from
+    the tensor, so the remaining steps only pay for replicas which are still burning.
+    Forests are drawn from one numpy generator, so replicas follow the model's statistics but are
+    not the forests ForestFireModel would draw for some seed.
+
+    :param L: size of model's grid
+    :param p: probability of tree's occurrence in a cell, a number or a sequence of numbers
+    :param iterations: number of replicas for each p
+    :param max_steps: upper limit of steps, as in BatchRunner
+    :param seed: seed of the numpy generator
+    :return: DataFrame with the columns of BatchRunner.get_model_vars_dataframe() for variable p,
+        fixed L and reporters {"p*": compute_p, "Cluster": compute_cluster}
+    """
+    p_values = np.atleast_1d(np.asarray(p, dtype=float))
+    replica_p = np.repeat(p_values, iterations)
+    rng = np.random.default_rng(seed)
+
+    state = np.where(rng.random((len(replica_p), L, L)) <= replica_p[:, None, None],
+                     OCCUPIED, NO_TREE).astype(np.uint8)
+    edge = state[:, L-1]
+    edge[edge == OCCUPIED] = BURNING
+
+    p_star = np.zeros(len(replica_p), dtype=int)
+    cluster = np.zeros(len(replica_p), dtype=int)
+    live = np.arange(len(replica_p))
+
+    def score(lattices, replicas):
+        for lattice, replica in zip(lattices, replicas):
+            p_star[replica] = np.any(lattice[0] == EMPTY)
+            cluster[replica] = max(cluster_sizes(lattice) + [count_unburnt(lattice)])
+
+    steps = 0
+    while len(live) and steps < max_steps:
+        burning = state == BURNING
+        ignite = moore_any(burning) & (state == OCCUPIED)
+        state[burning] = EMPTY
+        state[ignite] = BURNING
+        steps += 1
+
+        done = ~ignite.any(axis=(1, 2))
+        if done.any():
+            score(state[done], live[done])
+            state, live = state[~done], live[~done]
+    score(state, live)
+
+    return pd.DataFrame({"p": replica_p,
+                         "Run": np.arange(len(replica_p)),
+                         "Cluster": cluster,
+                         "p*": p_star,
+                         "L": L})
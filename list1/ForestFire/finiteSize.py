@@ -0,0 +1,177 @@
+import os
+import sys
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+from ForestFireModel import ForestFireModel
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from modelTools import NO_TREE, label_clusters
+from sweep import iter_sweep
+from resultCache import ResultCache, DEFAULT_PATH
+
+# Finite-size scaling of the percolation of trees. The fire reaches every tree Moore-connected to the
+# burning row, so the clusters which matter are the Moore clusters of the forest as it is drawn; they are
+# labelled once per run, without stepping the fire, and only their histogram leaves the worker.
+
+SCALING_PATH = os.path.join(DEFAULT_PATH, "scaling")
+
+
+def tree_labels(model):
+    # Moore clusters of all trees, labelled once per model and step (see compute_cluster_sizes)
+    cached = getattr(model, "_tree_labels", None)
+    if cached is None or cached[0] != model.schedule.steps:
+        labels = label_clusters(model.lattice != NO_TREE, moore=True)
+        sizes = np.bincount(labels.ravel())[1:]
+        model._tree_labels = cached = (model.schedule.steps, labels, sizes[sizes > 0])
+    return cached[1], cached[2]
+
+
+def compute_spanning(model):
+    # 1 if a cluster joins row L-1 (where the fire starts) and row 0, what compute_p reports after the fire
+    labels, _ = tree_labels(model)
+    return int(np.intersect1d(labels[-1][labels[-1] > 0], labels[0]).size > 0)
+
+
+def compute_largest(model):
+    _, sizes = tree_labels(model)
+    return int(sizes.max()) if len(sizes) else 0
+
+
+def compute_histogram(model):
+    # number of clusters with size in [2**k, 2**(k+1)) for every k up to the size of the whole grid
+    _, sizes = tree_labels(model)
+    bins = (model.L * model.L).bit_length()
+    return np.bincount(np.log2(sizes).astype(int) if len(sizes) else [], minlength=bins).astype(np.int64)
+
+
+def open_arrays(path, mode="r", sizes=None, p=None):
+    """
+    Memory-mapped arrays of a ladder, indexed by [L, p] (and the size bin of histogram):
+    runs, spanning (runs which span), largest (sum of the largest clusters) and histogram.
+
+    :param mode: "r" to read a finished ladder, "w+" to start a new one for the given sizes and p
+    """
+    if mode == "w+":
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, "L.npy"), np.asarray(sizes))
+        np.save(os.path.join(path, "p.npy"), np.asarray(p))
+    sizes = np.load(os.path.join(path, "L.npy"))
+    p = np.load(os.path.join(path, "p.npy"))
+    shapes = {"runs": (len(sizes), len(p)), "spanning": (len(sizes), len(p)), "largest": (len(sizes), len(p)),
+              "histogram": (len(sizes), len(p), int(sizes.max() ** 2).bit_length())}
+    arrays = {}
+    for name, shape in shapes.items():
+        dtype = np.float64 if name == "largest" else np.int64
+        arrays[name] = np.lib.format.open_memmap(os.path.join(path, name + ".npy"), mode=mode,
+                                                 dtype=dtype, shape=shape if mode == "w+" else None)
+    return sizes, p, arrays
+
+
+def run_ladder(sizes, p, iterations, path=SCALING_PATH, seed=None, cache=None, **kwargs):
+    """
+    Run ForestFireModel (numpy backend) for every L of the ladder and every p, and accumulate the histograms
+    of cluster sizes, the spanning runs and the largest clusters into memory-mapped arrays (see open_arrays).
+
+    Runs are done in parallel by sweep.iter_sweep, the largest grids first, and each is added to the arrays
+    as soon as it finishes; only its histogram comes back from the worker. At L=4096 a run takes about
+    10 s and, with the labels, about 1 GB of memory in its worker (see processes).
+    :param cache: optional ResultCache, an interrupted ladder then only runs what is missing
+    :param kwargs: passed to iter_sweep, e.g. processes
+    """
+    sizes, p, arrays = open_arrays(path, "w+", sizes, p)
+    for array in arrays.values():
+        array[:] = 0
+    row = {int(L): i for i, L in enumerate(sizes)}
+    column = {float(value): i for i, value in enumerate(p)}
+
+    reporters = {"Spanning": compute_spanning, "Largest": compute_largest, "Histogram": compute_histogram}
+    results = iter_sweep(ForestFireModel, {"L": sizes.tolist(), "p": p.tolist()}, {"backend": "numpy"},
+                         iterations, reporters, max_steps=0, seed=seed, cache=cache, **kwargs)
+    for run, params, values in results:
+        i, j = row[int(params["L"])], column[float(params["p"])]
+        arrays["runs"][i, j] += 1
+        arrays["spanning"][i, j] += values["Spanning"]
+        arrays["largest"][i, j] += values["Largest"]
+        arrays["histogram"][i, j, :len(values["Histogram"])] += values["Histogram"]
+    for array in arrays.values():
+        array.flush()
+
+
+def _fit_line(x, y):
+    # least squares y = a + b x, return (a, b, standard error of a, standard error of b)
+    design = np.column_stack([np.ones(len(x)), x])
+    coefficients, _, _, _ = np.linalg.lstsq(design, y, rcond=None)
+    if len(x) < 3:
+        return coefficients[0], coefficients[1], np.nan, np.nan
+    residual = y - design @ coefficients
+    covariance = np.linalg.inv(design.T @ design) * (residual @ residual) / (len(x) - 2)
+    return coefficients[0], coefficients[1], np.sqrt(covariance[0, 0]), np.sqrt(covariance[1, 1])
+
+
+def fit_scaling(path=SCALING_PATH, level=0.5):
+    """
+    Finite-size scaling estimates from a ladder written by run_ladder.
+
+    For every L the spanning probability P(p) gives p_c(L), where it crosses level, and its width, the standard
+    deviation of dP/dp. The width scales as L^(-1/nu), so nu comes from a log-log fit of the widths,
+    and p_c(L) = p_c + a L^(-1/nu) gives p_c as the intercept. At the p closest to p_c the largest cluster
+    grows as L^D and, on the largest grid, the number of clusters of size s per site falls as s^(-tau)
+    between the smallest clusters and the cut-off at the size of the largest one.
+    :return: dict with "p_c", "nu", "D", "tau", their standard errors ("p_c error", ...) and "thresholds"
+        (DataFrame of L, p_c(L) and the width)
+    """
+    sizes, p, arrays = open_arrays(path)
+    runs = np.maximum(arrays["runs"], 1)
+    spanning = arrays["spanning"] / runs
+
+    thresholds = []
+    for i, L in enumerate(sizes):
+        curve = np.maximum.accumulate(spanning[i])
+        steps = np.diff(curve)
+        middle = (p[1:] + p[:-1]) / 2
+        mean = (middle * steps).sum() / steps.sum()
+        width = np.sqrt((steps * (middle - mean) ** 2).sum() / steps.sum())
+        thresholds.append({"L": int(L), "p_c(L)": np.interp(level, curve, p), "width": width})
+    thresholds = pd.DataFrame(thresholds)
+
+    _, slope, _, slope_error = _fit_line(np.log(thresholds["L"]), np.log(thresholds["width"]))
+    nu = -1 / slope
+    p_c, _, p_c_error, _ = _fit_line(thresholds["L"] ** (-1 / nu), thresholds["p_c(L)"])
+
+    critical = int(np.argmin(np.abs(p - p_c)))
+    _, D, _, D_error = _fit_line(np.log(sizes), np.log(arrays["largest"][:, critical] / runs[:, critical]))
+
+    # clusters of size s per site on the largest grid, by bins [2**k, 2**(k+1))
+    biggest = len(sizes) - 1
+    counts = arrays["histogram"][biggest, critical].astype(float)
+    k = np.arange(len(counts))
+    density = counts / (2.0 ** k) / (sizes[biggest] ** 2 * runs[biggest, critical])
+    cutoff = np.log2(arrays["largest"][biggest, critical] / runs[biggest, critical]) - 4
+    used = (k >= 3) & (k <= cutoff) & (counts > 0)
+    _, slope, _, tau_error = _fit_line(np.log(2.0 ** (k[used] + 0.5)), np.log(density[used]))
+
+    return {"p_c": p_c, "p_c error": p_c_error, "nu": nu, "nu error": slope_error * nu ** 2,
+            "D": D, "D error": D_error, "tau": -slope, "tau error": tau_error, "thresholds": thresholds}
+
+
+if __name__ == '__main__':
+    L = [64, 128, 256, 512, 1024, 2048, 4096]
+    p = np.round(np.arange(0.38, 0.4401, 0.005), 3)
+
+    run_ladder(L, p, iterations=50, seed=0, cache=ResultCache())
+    fit = fit_scaling()
+    print(fit["thresholds"])
+    for name in ("p_c", "nu", "D", "tau"):
+        print("{} = {:.4f} +- {:.4f}".format(name, fit[name], fit[name + " error"]))
+
+    sizes, p, arrays = open_arrays(SCALING_PATH)
+    spanning = arrays["spanning"] / np.maximum(arrays["runs"], 1)
+    for i in range(len(sizes)):
+        plt.plot(p, spanning[i], '-o', label='L = ' + str(sizes[i]))
+    plt.axvline(fit["p_c"], color='gray', linestyle='--')
+    plt.title(r'Spanning probability, $p_c$ = {:.4f}'.format(fit["p_c"]))
+    plt.xlabel(r'$p$')
+    plt.ylabel('fraction of spanning forests')
+    plt.legend()
+    plt.show()
@@ -0,0 +1,112 @@
+import os
+import sys
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from modelTools import NO_TREE, OCCUPIED, BURNING, EMPTY, MOORE, moore_any, label_clusters, jit
+
+
+def draw_forest(L, p, rng):
+    """
+    Forest at the start of a run: every cell holds a tree with probability p, the trees of row L-1 burn.
+
+    :param rng: numpy Generator, the whole forest is drawn in one call
+    :return: L x L uint8 lattice
+    """
+    lattice = np.where(rng.random((L, L)) <= p, OCCUPIED, NO_TREE).astype(np.uint8)
+    lattice[L-1][lattice[L-1] == OCCUPIED] = BURNING
+    return lattice
+
+
+def burn_step(lattice):
+    """
+    Advance the lattice by one step in place.
+
+    Burning trees burn out and every occupied tree with a burning neighbour starts burning,
+    exactly as TreeAgent.step()/advance() under SimultaneousActivation.
+    :return: number of trees burning after the step
+    """
+    burning = lattice == BURNING
+    ignite = moore_any(burning) & (lattice == OCCUPIED)
+    lattice[burning] = EMPTY
+    lattice[ignite] = BURNING
+    return int(np.count_nonzero(ignite))
+
+
+def burn_block(halo, out, rng):
+    # burn_step of the rows halo[1:-1] written to out, the first and the last row only provide neighbours
+    burning = halo == BURNING
+    ignite = moore_any(burning)[1:-1] & (halo[1:-1] == OCCUPIED)
+    out[:] = halo[1:-1]
+    out[burning[1:-1]] = EMPTY
+    out[ignite] = BURNING
+    return int(np.count_nonzero(ignite))
+
+
+def front_step(lattice, front):
+    """
+    Advance the lattice by one step in place, visiting only the fire front.
+
+    :param front: (rows, cols) of the burning trees, as returned by np.nonzero
+    :return: (rows, cols) of the trees burning after the step
+    """
+    rows, cols = lattice.shape
+    x = (front[0][:, None] + MOORE[:, 0]).ravel()
+    y = (front[1][:, None] + MOORE[:, 1]).ravel()
+    inside = (x >= 0) & (x < rows) & (y >= 0) & (y < cols)
+    x, y = x[inside], y[inside]
+    hit = lattice[x, y] == OCCUPIED
+    ignite = np.unique(x[hit] * cols + y[hit])
+    lattice[front] = EMPTY
+    lattice.flat[ignite] = BURNING
+    return np.divmod(ignite, cols)
+
+
+IGNITED = 4  # code of a tree set on fire during a jit step, before the step ends
+
+
+def _jit_front(lattice, rows, cols):
+    # compiled by jit_front_step: one step from the burning trees (rows, cols), return the new front
+    height, width = lattice.shape
+    new_rows = np.empty(8 * len(rows), dtype=np.int64)
+    new_cols = np.empty(8 * len(rows), dtype=np.int64)
+    count = 0
+    for k in range(len(rows)):
+        for dx in range(-1, 2):
+            for dy in range(-1, 2):
+                x, y = rows[k] + dx, cols[k] + dy
+                if 0 <= x < height and 0 <= y < width and lattice[x, y] == OCCUPIED:
+                    lattice[x, y] = IGNITED
+                    new_rows[count] = x
+                    new_cols[count] = y
+                    count += 1
+    for k in range(len(rows)):
+        lattice[rows[k], cols[k]] = EMPTY
+    for k in range(count):
+        lattice[new_rows[k], new_cols[k]] = BURNING
+    order = np.argsort(new_rows[:count] * width + new_cols[:count])
+    return new_rows[:count][order], new_cols[:count][order]
+
+
+def jit_front_step(lattice, front):
+    """
+    front_step compiled by numba: the same step, in one loop over the front without temporary arrays.
+
+    :return: (rows, cols) of the trees burning after the step, row by row as from np.nonzero
+    """
+    return jit(_jit_front)(lattice, front[0].astype(np.int64), front[1].astype(np.int64))
+
+
+def burn_out(lattice):
+    """
+    Bring the lattice in place to the state in which the fire dies, without stepping.
+
+    Without wind the fire reaches every tree Moore-connected to a burning tree and nothing else,
+    so one labelling pass over the trees finds every tree which will burn.
+    """
+    trees = (lattice == OCCUPIED) | (lattice == BURNING)
+    labels = label_clusters(trees, moore=True)
+    lit = np.unique(labels[lattice == BURNING])
+    lattice[trees & np.isin(labels, lit)] = EMPTY
+
+
@@ -1,41 +1,43 @@
+import os
+import sys
 import matplotlib.pyplot as plt
-from mesa.batchrunner import BatchRunner
 from ForestFireModel import ForestFireModel, compute_p
 import numpy as np
-import multiprocessing
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sweep import run_sweep
+from resultCache import ResultCache
+from workQueue import secret_key
 
-def perlocation(L):
 
-    fixed_params = {"L": L}
+if __name__ == '__main__':
+    # with a queue (e.g. file:/shared/queue or socket::5800, see workQueue) the runs are done by workers on
+    # other nodes; a socket queue takes its secret key from the file argv[2], or see workQueue.secret_key
+    queue = sys.argv[1] if len(sys.argv) > 1 else None
+    authkey = secret_key(key_file=sys.argv[2]) if len(sys.argv) > 2 else None
+    L = [25, 50]
+    p = np.arange(0, 1.1, 0.1)
 
-    variable_params = {"p": np.arange(0, 1.1, 0.1)}
+    # the fire reaches row 0 exactly when the trees span the grid, so no need to step the fire
+    fixed_params = {"backend": "numpy", "propagation": "static"}
 
-    batch_run = BatchRunner(
+    variable_params = {"L": L, "p": p}
+
+    run_data = run_sweep(
         ForestFireModel,
         variable_params,
         fixed_params,
         iterations=100,
-        model_reporters={"p*": compute_p}
+        model_reporters={"p*": compute_p},
+        cache=ResultCache(),
+        queue=queue,
+        authkey=authkey
     )
 
-    batch_run.run_all()
-
-    run_data = batch_run.get_model_vars_dataframe()
-
-    data = run_data.groupby('p').mean()
-    return data["p*"]
-
-
-if __name__ == '__main__':
-    L = [25, 50]
-    p = np.arange(0, 1.1, 0.1)
-
-    multiprocess = multiprocessing.Pool()
-    a = multiprocess.map(perlocation, L)
+    data = run_data.groupby(['L', 'p'])["p*"].mean()
 
     for i in range(len(L)):
-        plt.plot(p, a[i], '-o', label='L = ' + str(L[i]))
+        plt.plot(p, data[L[i]], '-o', label='L = ' + str(L[i]))
     plt.title(r'Percolation threshold $p^*$')
     plt.xlabel(r'$p$')
     plt.ylabel(r'$p^*$')
@@ -0,0 +1,23 @@
+from ForestFireModel import ForestFireModel, compute_p, compute_cluster
+import numpy as np
+
+
+def crossCheck(L, p, seeds, backend="numpy"):
+    # static evaluation has to give the same p* and cluster as stepping the fire to its end
+    for seed in seeds:
+        results = []
+        for propagation in ["scan", "static"]:
+            model = ForestFireModel(L, p, backend=backend, propagation=propagation, seed=seed)
+            model.run_model()
+            results.append((compute_p(model), compute_cluster(model)))
+        if results[0] != results[1]:
+            raise AssertionError("L = {}, p = {}, seed = {}: scan {} != static {}".format(
+                L, p, seed, results[0], results[1]))
+
+
+if __name__ == '__main__':
+    for L in [1, 2, 10, 25, 50]:
+        for p in np.arange(0, 1.1, 0.1):
+            crossCheck(L, p, range(20))
+            crossCheck(L, p, range(3), backend="agents")
+    print("static percolation agrees with the simulated fire")
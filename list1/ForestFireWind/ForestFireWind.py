@@ -1,62 +1,121 @@
-from mesa import Agent, Model
-from mesa.time import SimultaneousActivation
+from mesa import Model
+from mesa.time import SimultaneousActivation, BaseScheduler
 from mesa.space import Grid
 from mesa.datacollection import DataCollector
 from collections import Counter
+from random import Random
+from time import perf_counter
+import os
+import weakref
+import numpy as np
+from fireLatticeWind import draw_forest, wind_kernel, wind_step, wind_block, wind_front_step, open_raster, \
+    WindField, jit_wind_front_step
+from modelTools import NO_TREE, OCCUPIED, BURNING, EMPTY, STATUS, CODE, cluster_sizes, count_unburnt, \
+    count_perimeter, Tiles, save_snapshot, load_snapshot, JIT, NO_PHASE, Profile, Recorder, timed
 
+BACKENDS = ["agents", "numpy", "jit"]
+SOURCES = ["fireLatticeWind", "modelTools"]  # modules the results depend on, see resultCache.code_version
 
-class TreeAgent(Agent):
-    def __init__(self, id, model, status):
-        super().__init__(id, model)
-        self.status = status
-        self.changed = 0
+
+class TreeAgent:
+    """Tree of the "agents" backend, status is a read-only view of its lattice code (see modelTools)."""
+    __slots__ = ("unique_id", "model", "pos", "code", "changed", "cluster")
+
+    def __init__(self, id, model, code):
+        self.unique_id = id
+        self.model = model
+        self.pos = None
+        self.code = code
+        self.changed = False
         self.cluster = None
 
+    @property
+    def status(self):
+        return STATUS[self.code]
+
+    @property
+    def random(self):
+        return self.model.random
+
     def step(self):  # function performed at the model step
-        if self.status == "burning":
-            self.changed = 1
-        elif self.status == "occupied":
+        if self.code == BURNING:
+            self.changed = True
+        elif self.code == OCCUPIED:
             neighbours = self.model.grid.get_neighbors(
                 self.pos,
                 moore=True,
                 include_center=False)
 
-            burningThrees = {x.pos: x for x in neighbours if x.status == "burning"}
+            burningThrees = {x.pos for x in neighbours if x.code == BURNING}
 
             if burningThrees:
                 probability = 0.5
-                direction = self.model.direction
-                if (self.pos[0] - direction[0], self.pos[1] - direction[1]) in list(burningThrees.keys()):
-                    probability += 0.5*self.model.strength
-                elif (self.pos[0] + direction[0], self.pos[1] + direction[1]) in list(burningThrees.keys()):
-                    probability += 0.5 * self.model.strength
+                upwind, up, down = self.model.kernel_at(self.pos)  # precomputed, see ForestFireModel
+                if upwind is not None:
+                    if (self.pos[0] + upwind[0], self.pos[1] + upwind[1]) in burningThrees:
+                        probability = up
+                    elif (self.pos[0] - upwind[0], self.pos[1] - upwind[1]) in burningThrees:
+                        probability = down
 
                 if self.random.random() <= probability:
-                    self.changed = 1
+                    self.changed = True
 
     def advance(self):  # function performed after step() function
-        if self.changed == 1:
-            if self.status == "burning":
-                self.status = "empty"
-                self.changed = 0
-            elif self.status == "occupied":
-                self.status = "burning"
-                self.changed = 0
+        if self.changed:
+            self.code = EMPTY if self.code == BURNING else BURNING
+            self.changed = False
 
 
 class ForestFireModel(Model):
-    def __init__(self, L, p, direction, strength):
+    def __init__(self, L, p, direction, strength, backend="agents", propagation="scan", seed=None,
+                 instrument=False, record=False, processes=1, lattice=None):
 
         """
         :param L: size of model's grid
-        :param p: probability of tree's occurrence in a cell
+        :param p: probability of tree's occurrence in a cell, or L x L array of the fuel density of every
+            cell, or the path of its .npy file, mapped instead of read (see fireLatticeWind.open_raster)
         :param direction: tuple (x,y) - direction of the wind:
             (0,0) - no wind,
             (0,1) - North, (0,-1) - South,
             (1,0) - East, (-1,0) - West,
             (1,1) - North-East, (-1,1) - North-West,
             (1,-1) - South-East, (-1,-1) - South-West.
-        :param strength: int [0,1] - let's assume 0 - 0 km/h, 1 - 100km/h
+            Or L x L x 2 array of the direction in every cell (or its .npy file), or a WindField.
+        :param strength: int [0,1] - let's assume 0 - 0 km/h, 1 - 100km/h; or L x L array of the strength in
+            every cell (or its .npy file); ignored with a WindField.
+            With wind differing from cell to cell the kernel of every cell is computed once, into field
+            (see fireLatticeWind.WindField); for big landscapes build the WindField with a path once and
+            pass it as direction, its kernel is then mapped from the files too.
+        :param backend: "agents" - one TreeAgent per tree stepped by SimultaneousActivation,
+            "numpy" - the whole forest kept in one uint8 array (see fireLatticeWind); the wind rule
+            is precomputed once as ignition probabilities by neighbour offset and all random numbers
+            of a step are drawn in one batch; TreeAgents are made only if grid is used (e.g. by the
+            visualization),
+            "jit" - the lattice of "numpy" stepped by a loop compiled with numba (an optional dependency,
+            see fireLatticeWind.jit_wind_front_step); it draws the same random numbers as numpy, so both give
+            the same results. It has only front propagation, "scan" is taken as "front".
+            All backends draw the same forest for the same seed (in one call, see fireLatticeWind.draw_forest),
+            the fire then spreads with the same probabilities, but agents draws different random numbers
+            (see benchmarks/equivalence.py).
+        :param propagation: "scan" - every step visits every tree,
+            "front" - every step visits only the burning trees and their neighbours, and the number
+            of burning trees is kept up to date instead of being searched for.
+            Trees are visited in the same order, so both modes give the same results for the same seed.
+            The jit backend always runs "front" (propagation is then "front" whatever was asked).
+        :param seed: seed of the model's random generator
+        :param instrument: if True, the model keeps a Profile of the run in profile (None otherwise,
+            which costs next to nothing); compute_profile reports it
+        :param record: if True, the model records every step (and the start) in recorder: step, the number of
+            burning, occupied and burnt trees, front (occupied trees next to a burning one) and rows reached
+            (rows from L-1 down to the lowest one the fire has got to, L when it percolates);
+            compute_steps returns them as a DataFrame
+        :param processes: numpy backend with scan propagation only: if more than 1, the lattice is cut into
+            that many strips of rows kept in shared memory and stepped in lockstep by as many worker
+            processes (see modelTools.Tiles), for a single lattice too large for one core. Every
+            strip draws its own random numbers, so the fire is the same only in distribution.
+            The workers stop when the fire dies (or on close). Needs the same wind in every cell.
+        :param lattice: optional L x L array of lattice codes (see fireLatticeWind) to start from instead of
+            drawing a forest, e.g. a snapshot (see save and restore)
 
         At the beginning we assume that every tree has probability of becoming a burning cell equal to 0.5
         (if has burning neighbour).
@@ -71,93 +130,376 @@ class ForestFireModel(Model):
 
         """
 
+        started = perf_counter()
         super().__init__()
-        self.grid = Grid(L, L, False)
-        self.schedule = SimultaneousActivation(self)
+        self.random = Random(seed)  # Mesa's generator is shared by every model of the class
+        self.profile = Profile() if instrument else None
         self.running = True
+        self.L = L
         self.p = p
         self.direction = direction
         self.strength = strength
+        # kernel of every cell: a WindField if the wind differs from cell to cell, otherwise one for all cells
+        self.field = None
+        if isinstance(direction, WindField):
+            self.field = direction
+        elif np.ndim(open_raster(direction)) == 3 or np.ndim(open_raster(strength)) == 2:
+            self.field = WindField(direction, strength)
+        else:
+            upwind = (-direction[0], -direction[1]) if tuple(direction) != (0, 0) else None
+            self.uniform = (upwind, 0.5 + 0.5 * strength, 0.5 - 0.5 * strength)
+        self.backend = backend
+        if propagation not in ("scan", "front"):
+            raise ValueError("Unknown propagation: " + str(propagation))
+        if backend == "jit" and propagation == "scan":  # the jit kernels only step the front
+            propagation = "front"
+        self.propagation = propagation
 
-        for i in range(L):
-            for j in range(L):
-                if self.random.random() <= self.p:
-                    if i == L-1:
-                        tree = TreeAgent((i, j), self, "burning")
-                    else:
-                        tree = TreeAgent((i, j), self, "occupied")
-                    self.schedule.add(tree)
-                    self.grid.place_agent(tree, (i, j))
+        # the forest is drawn in one call by a generator seeded from the model's one
+        self.rng = np.random.default_rng(self.random.getrandbits(64))
+        if lattice is None:
+            lattice = draw_forest(L, open_raster(p), self.rng)
+        self.trees = int(np.count_nonzero(lattice))
+        self._grid = None
+        if backend == "agents":
+            self.schedule = SimultaneousActivation(self)
+            self._grid = Grid(L, L, False)
+            for tree in self.make_agents(lattice):
+                self.schedule.add(tree)
+            self.front = [tree for tree in self.schedule.agents if tree.code == BURNING]
+        elif backend in ("numpy", "jit"):
+            if backend == "jit" and not JIT:
+                raise ValueError("The jit backend needs numba")
+            self.schedule = BaseScheduler(self)
+            self.lattice = lattice
+            self.front = np.nonzero(self.lattice == BURNING)
+            self.kernel = self.field if self.field is not None else wind_kernel(tuple(direction), strength)
+        else:
+            raise ValueError("Unknown backend: " + str(backend))
+
+        self.tiles = None
+        if processes > 1:
+            if backend != "numpy" or propagation != "scan" or self.field is not None:
+                raise ValueError("processes > 1 needs the numpy backend with scan propagation and uniform wind")
+            self.tiles = Tiles(self.lattice, wind_block, processes, args=(self.kernel,),
+                               seed=int(self.rng.integers(2 ** 63)))
+            self.lattice = self.tiles.lattice
+            weakref.finalize(self, self.tiles.close)
 
         self.datacollector = DataCollector(
             model_reporters={"p*": compute_p, "Cluster": compute_cluster})
+        self.recorder = None
+        if record:
+            self.recorder = Recorder(["step", "burning", "occupied", "burnt", "front", "rows reached"])
+            self.record()
+        if self.profile is not None:
+            self.profile.times["init"] += perf_counter() - started
+            self.profile.calls["init"] += 1
+
+    def phase(self, name):
+        return NO_PHASE if self.profile is None else self.profile.phase(name)
+
+    @property
+    def grid(self):
+        # Grid of the TreeAgents; the numpy and jit backends make them from the lattice only when something
+        # (e.g. the CanvasGrid of the visualization) first asks for them, and keeps them up to date
+        if self._grid is None:
+            self._grid = Grid(self.L, self.L, False)
+            self.make_agents(self.lattice)
+            self._shown = self.lattice.copy()
+        return self._grid
+
+    def kernel_at(self, pos):
+        # (upwind offset or None, up, down) of the tree at pos, see fireLatticeWind.WindField
+        return self.uniform if self.field is None else self.field.kernel_at(pos)
+
+    def make_agents(self, lattice):
+        # one TreeAgent per tree of the lattice placed on the grid, row by row, return them
+        trees = []
+        for i, j in zip(*(a.tolist() for a in np.nonzero(lattice))):
+            tree = TreeAgent((i, j), self, int(lattice[i, j]))
+            self._grid.place_agent(tree, (i, j))
+            trees.append(tree)
+        return trees
+
+    def sync_agents(self):
+        # numpy and jit backends: copy the statuses of the changed cells of the lattice to their agents
+        for i, j in zip(*(a.tolist() for a in np.nonzero(self.lattice != self._shown))):
+            self._grid[i][j].code = int(self.lattice[i, j])
+        self._shown = self.lattice.copy()
+
+    def save(self, path):
+        """
+        Write a snapshot of the model to path (see modelTools.save_snapshot): its lattice, parameters,
+        step count, whether it runs and the states of both random generators. The recorder and the profile
+        are not saved.
+        """
+        lattice = self.to_lattice() if self.backend == "agents" else self.lattice
+        save_snapshot(path, lattice, {
+            "params": {"L": self.L, "p": _saved(self.p, True), "direction": _saved(self.direction),
+                       "strength": None if isinstance(self.direction, WindField) else _saved(self.strength),
+                       "backend": self.backend, "propagation": self.propagation},
+            "steps": self.schedule.steps, "time": self.schedule.time, "running": self.running,
+            "random": self.random.getstate(), "rng": self.rng.bit_generator.state})
+
+    @classmethod
+    def restore(cls, path, **changes):
+        """
+        Model continuing from a snapshot written by save, as the saved one would have gone on.
+
+        The lattice is mapped copy-on-write from the file, so nothing is read until it is used and the
+        file is never changed.
+        :param changes: parameters to change from the snapshot, e.g. processes, direction or strength;
+            with seed the random generators start from it instead of their saved states
+        """
+        lattice, state = load_snapshot(path)
+        params = dict(state["params"], **changes)
+        if isinstance(params["direction"], dict):
+            params["direction"] = WindField.open(params["direction"]["field"])
+        model = cls(**params, lattice=lattice)
+        model.schedule.steps = state["steps"]
+        model.schedule.time = state["time"]
+        model.running = state["running"]
+        if model.recorder is not None:  # its first row was recorded before the steps were restored
+            model.recorder.size = 0
+            model.record()
+        if "seed" not in changes:
+            version, internal, gauss = state["random"]
+            model.random.setstate((version, tuple(internal), gauss))
+            model.rng.bit_generator.state = state["rng"]
+        return model
+
+    @classmethod
+    def fork(cls, path, count, seed=None, **changes):
+        """
+        count models continuing from one snapshot, without running the steps before it again.
+
+        Every continuation has its own random generators, seeded with seed, seed + 1, ... (or at random),
+        so they diverge as the fire spreads.
+        :param changes: passed to restore, e.g. a new direction of the wind
+        """
+        return [cls.restore(path, seed=None if seed is None else seed + i, **changes) for i in range(count)]
 
     def step(self):
-        self.schedule.step()
+        if self.profile is not None:
+            self.profile.touched.append(self.cells_touched())
+
+        burning = True
+        with self.phase("step"):
+            if self.propagation == "front":
+                burning = self.front_step()
+            elif self.tiles is not None:
+                burning = self.tiles.step()
+                self.lattice = self.tiles.lattice
+                self.schedule.step()
+            elif self.backend == "numpy":
+                burning = wind_step(self.lattice, self.kernel, self.rng)
+                self.schedule.step()
+            else:
+                self.schedule.step()
+        if self.backend != "agents" and self._grid is not None:
+            self.sync_agents()
+        if self.propagation == "scan" and self.backend == "agents":
+            with self.phase("scan"):
+                burning = self.exists_status("burning")
+        if self.recorder is not None:
+            with self.phase("record"):
+                self.record()
 
-        if not self.exists_status("burning"):
-            self.datacollector.collect(self)
+        if not burning:
+            self.close()
+            with self.phase("reporters"):
+                self.datacollector.collect(self)
             self.running = False
 
+    def close(self):
+        # stop the worker processes of processes > 1, the lattice is kept in this process
+        if self.tiles is not None:
+            self.lattice = self.lattice.copy()
+            self.tiles.close()
+            self.tiles = None
+
+    def cells_touched(self):
+        # cells the next step visits: the burning trees and their neighbours, or the whole forest
+        if self.propagation == "front":
+            return 9 * len(self.front if self.backend == "agents" else self.front[0])
+        if self.backend == "agents":
+            return self.schedule.get_agent_count()
+        return self.L * self.L
+
+    def to_lattice(self):
+        # agents backend: the forest as a lattice of codes (see fireLatticeWind)
+        lattice = np.full((self.L, self.L), NO_TREE, dtype=np.uint8)
+        for tree in self.schedule.agents:
+            lattice[tree.pos] = tree.code
+        return lattice
+
+    def front_step(self):  # step only the burning trees and their neighbours, return number of burning trees
+        if self.backend == "jit":
+            self.front = jit_wind_front_step(self.lattice, self.front, self.kernel, self.rng)
+            self.schedule.step()
+            return len(self.front[0])
+        if self.backend == "numpy":
+            self.front = wind_front_step(self.lattice, self.front, self.kernel, self.rng)
+            self.schedule.step()
+            return len(self.front[0])
+
+        neighbours = {}
+        for tree in self.front:
+            for agent in self.grid.get_neighbors(tree.pos, moore=True, include_center=False):
+                if agent.code == OCCUPIED:
+                    neighbours[agent.pos] = agent
+        # keep the order of the schedule, in which the scan visits the trees (and draws random numbers)
+        touched = self.front + [neighbours[pos] for pos in sorted(neighbours)]
+        for tree in touched:
+            tree.step()
+        for tree in touched:
+            tree.advance()
+        self.schedule.steps += 1
+        self.schedule.time += 1
+
+        self.front = [tree for tree in touched if tree.code == BURNING]
+        return len(self.front)
+
+    def record(self):
+        # append the forest after the last step (or at the start) to the recorder
+        if self.backend != "agents":
+            front = self.front if self.propagation == "front" else np.nonzero(self.lattice == BURNING)
+            rows = front[0]
+            perimeter = count_perimeter(self.lattice, front)
+        else:
+            if self.propagation == "front":
+                burning = self.front
+            else:
+                burning = [tree for tree in self.schedule.agents if tree.code == BURNING]
+            rows = [tree.pos[0] for tree in burning]
+            perimeter = len({agent.pos for tree in burning
+                             for agent in self.grid.get_neighbors(tree.pos, moore=True, include_center=False)
+                             if agent.code == OCCUPIED})
+
+        if self.recorder.size:  # every tree burns for one step, so the burnt ones are counted as they go
+            burnt = self.recorder.last("burnt") + self.recorder.last("burning")
+            reached = self.recorder.last("rows reached")
+        else:  # the start, or a restored snapshot: count what has burnt so far
+            burnt_rows = np.nonzero((self.to_lattice() if self.backend == "agents" else self.lattice) == EMPTY)[0]
+            burnt = len(burnt_rows)
+            reached = self.L - int(burnt_rows.min()) if burnt else 0
+        if len(rows):
+            reached = max(reached, self.L - int(np.min(rows)))
+        self.recorder.append(self.schedule.steps, len(rows), self.trees - len(rows) - burnt, burnt, perimeter,
+                             reached)
+
     def exists_status(self, status):  # function checking if there is any tree which has given status
+        code = CODE[status]
         for tree in self.schedule.agents:
-            if tree.status == status:
+            if tree.code == code:
                 return True
 
 
+def _saved(value, drawn=False):
+    # a parameter as saved in a snapshot: a per-cell field by the .npy file (or WindField directory) it is
+    # mapped from; drawn - only used to draw the forest, which the snapshot keeps, so any field will do
+    if isinstance(value, WindField) and value.path is not None:
+        return {"field": os.fspath(value.path)}
+    if isinstance(value, np.memmap) and str(value.filename).endswith(".npy"):
+        return value.filename
+    if isinstance(value, (np.ndarray, WindField)):
+        if drawn:
+            return None
+        raise ValueError("Only fields kept in files can be saved, pass their paths (or a WindField with a path)")
+    if isinstance(value, os.PathLike):
+        return os.fspath(value)
+    return value
+
+
+@timed
 def compute_p(model):
+    if model.backend != "agents":
+        return int(np.any(model.lattice[0] == EMPTY))
     for agent in model.schedule.agents:
-        if agent.pos[0] == 0 and agent.status == "empty":
+        if agent.pos[0] == 0 and agent.code == EMPTY:
             return 1
     return 0
 
 
+@timed
 def compute_cluster(model):
-    # Get sorted list of agents
-    agents = sorted([agent for agent in model.schedule.agents], key=lambda tup: (tup.pos[0], tup.pos[1]))
+    sizes = compute_cluster_sizes(model)
+    # trees which have not burnt keep cluster None and are counted together, as one more "cluster"
+    if model.backend != "agents":
+        unburnt = count_unburnt(model.lattice)
+    else:
+        unburnt = sum(1 for agent in model.schedule.agents if agent.cluster is None)
+    return max(sizes + [unburnt])
 
-    largestLabel = 0
 
-    for agent in agents:
-        if agent.status == "empty":  # if agent was burned
-            neighbours = model.grid.get_neighbors(
-                agent.pos,
-                moore=False,
-                include_center=False)
-            neighboursDict = {x.pos: x for x in neighbours}
+@timed
+def compute_cluster_sizes(model):
+    """
+    Sizes of all clusters of burnt trees (neighbours: left and below), from the largest.
 
-            # Get left and below neighbour, if one of them doesn't exist, set as None
-            if (agent.pos[0] - 1, agent.pos[1]) in list(neighboursDict.keys()):
-                left = neighboursDict.get((agent.pos[0] - 1, agent.pos[1]))
-                if not left.cluster:
-                    left = None
-            else:
-                left = None
-            if (agent.pos[0], agent.pos[1] - 1) in list(neighboursDict.keys()):
-                below = neighboursDict.get((agent.pos[0], agent.pos[1] - 1))
-                if not below.cluster:
-                    below = None
-            else:
-                below = None
-
-            if not left and not below:  # If considered neighbours don't exist
-                largestLabel += 1
-                agent.cluster = largestLabel  # set new cluster
-            elif left and not below:  # If left exists and below doesn't exist
-                agent.cluster = left.cluster  # set the same cluster to agent as in left neighbour
-            elif not left and below:  # If below exists and left doesn't exist
-                agent.cluster = below.cluster  # set the same cluster to agent as in below neighbour
-            elif left and below:  # If both of them exist
-                minCluster = min(left.cluster, below.cluster)
-                maxCluster = max(left.cluster, below.cluster)
-                agent.cluster = minCluster  # set agent's cluster as minimum of left and below clusters
-                for temp in agents:  # and change cluster for every agent having maximum cluster
-                    if temp.cluster == maxCluster:
-                        temp.cluster = minCluster
-
-    clusters = [agent.cluster for agent in agents]
-    biggest = Counter(clusters)
-    if biggest:  # if there is any cluster
-        return max(list(biggest.values()))
+    Clusters are labelled in one pass with union-find (Hoshen-Kopelman), so merging two labels
+    costs almost nothing. The result is kept on the model until the next step, so reporting both
+    compute_cluster and compute_cluster_sizes labels the forest only once.
+    """
+    cached = getattr(model, "_cluster_sizes", None)
+    if cached is not None and cached[0] == model.schedule.steps:
+        return list(cached[1])
+
+    if model.backend != "agents":
+        sizes = cluster_sizes(model.lattice)
     else:
-        return 0
+        sizes = label_agents(model)
+    model._cluster_sizes = (model.schedule.steps, sizes)
+    return list(sizes)
+
+
+def label_agents(model):
+    # Set cluster of every burned agent, return sizes of the clusters
+    parent = []  # parent[label] - label which label was merged into, label is a root if parent[label] == label
+
+    def find(label):
+        root = label
+        while parent[root] != root:
+            root = parent[root]
+        while parent[label] != root:  # path compression
+            parent[label], label = root, parent[label]
+        return root
+
+    labels = {}
+    for agent in sorted(model.schedule.agents, key=lambda tup: (tup.pos[0], tup.pos[1])):
+        agent.cluster = None
+        if agent.code == EMPTY:  # if agent was burned
+            # Get labels of left and below neighbour, None if the neighbour isn't a burned tree
+            left = labels.get((agent.pos[0] - 1, agent.pos[1]))
+            below = labels.get((agent.pos[0], agent.pos[1] - 1))
+
+            if left is None and below is None:  # If considered neighbours don't exist
+                label = len(parent)  # set new cluster
+                parent.append(label)
+            elif below is None:
+                label = find(left)
+            elif left is None:
+                label = find(below)
+            else:  # If both of them exist, merge the larger label into the smaller one
+                left, below = find(left), find(below)
+                label = min(left, below)
+                parent[max(left, below)] = label
+            labels[agent.pos] = label
+
+    sizes = Counter()
+    for agent in model.schedule.agents:
+        if agent.pos in labels:
+            agent.cluster = find(labels[agent.pos]) + 1
+            sizes[agent.cluster] += 1
+    return sorted(sizes.values(), reverse=True)
+
+
+def compute_profile(model):
+    # Profile.summary of an instrumented model (instrument=True), None otherwise
+    return None if model.profile is None else model.profile.summary()
+
+
+def compute_steps(model):
+    # DataFrame of the steps recorded by the model (record=True), None otherwise
+    return None if model.recorder is None else model.recorder.frame()
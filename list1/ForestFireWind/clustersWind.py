@@ -1,55 +1,60 @@
+import os
+import sys
 import matplotlib.pyplot as plt
-from mesa.batchrunner import BatchRunner
 from ForestFireWind import ForestFireModel, compute_cluster
 import numpy as np
-import multiprocessing
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sweep import run_sweep
+from resultCache import ResultCache
+from workQueue import secret_key
 
-def clusterDirection(direction):
 
-    fixed_params = {"L": 25, "strength": 0.5, "direction": direction}
+def clusterDirection(direction, p, queue=None, authkey=None):
 
-    variable_params = {"p": np.arange(0, 1.1, 0.1)}
+    fixed_params = {"L": 25, "strength": 0.5}
 
-    batch_run = BatchRunner(
+    variable_params = {"direction": direction, "p": p}
+
+    run_data = run_sweep(
         ForestFireModel,
         variable_params,
         fixed_params,
         iterations=100,
-        model_reporters={"cluster": compute_cluster}
+        model_reporters={"cluster": compute_cluster},
+        cache=ResultCache(),
+        queue=queue,
+        authkey=authkey
     )
 
-    batch_run.run_all()
-
-    run_data = batch_run.get_model_vars_dataframe()
-
-    data = run_data.groupby('p').mean()
-    return data["cluster"]
+    return run_data.groupby(['direction', 'p'])["cluster"].mean()
 
 
-def clusterStrength(strength):
+def clusterStrength(strength, p, queue=None, authkey=None):
 
-    fixed_params = {"L": 25, "strength": strength, "direction": (1, 1)}
+    fixed_params = {"L": 25, "direction": (1, 1)}
 
-    variable_params = {"p": np.arange(0, 1.1, 0.1)}
+    variable_params = {"strength": strength, "p": p}
 
-    batch_run = BatchRunner(
+    run_data = run_sweep(
         ForestFireModel,
         variable_params,
         fixed_params,
         iterations=100,
-        model_reporters={"cluster": compute_cluster}
+        model_reporters={"cluster": compute_cluster},
+        cache=ResultCache(),
+        queue=queue,
+        authkey=authkey
     )
 
-    batch_run.run_all()
-
-    run_data = batch_run.get_model_vars_dataframe()
-
-    data = run_data.groupby('p').mean()
-    return data["cluster"]
+    return run_data.groupby(['strength', 'p'])["cluster"].mean()
 
 
 if __name__ == '__main__':
+    # with a queue (e.g. file:/shared/queue or socket::5800, see workQueue) the runs are done by workers on
+    # other nodes; a socket queue takes its secret key from the file argv[2], or see workQueue.secret_key
+    queue = sys.argv[1] if len(sys.argv) > 1 else None
+    authkey = secret_key(key_file=sys.argv[2]) if len(sys.argv) > 2 else None
 
     p = np.arange(0, 1.1, 0.1)
     direction = [(0, 0), (0, 1), (0, -1), (1, 0), (-1, 0), (1, 1), (-1, 1), (1, -1), (-1, -1)]
@@ -57,21 +62,20 @@ if __name__ == '__main__':
                      'South-East', 'South-West']
     strength = np.arange(0, 1.1, 0.25)
 
-    multiprocess = multiprocessing.Pool()
-    a = multiprocess.map(clusterDirection, direction)
+    a = clusterDirection(direction, p, queue, authkey)
 
     for i in range(len(direction)):
-        plt.plot(p, a[i], '-o', label=str(directionText[i]))
+        plt.plot(p, a[direction[i]], '-o', label=str(directionText[i]))
     plt.title(r'The biggest cluster dependent of $p$')
     plt.xlabel(r'$p$')
     plt.ylabel('average size of the biggest cluster')
     plt.legend()
     plt.show()
 
-    a = multiprocess.map(clusterStrength, strength)
+    a = clusterStrength(strength, p, queue, authkey)
 
     for i in range(len(strength)):
-        plt.plot(p, a[i], '-o', label='strength = ' + str(strength[i]))
+        plt.plot(p, a[strength[i]], '-o', label='strength = ' + str(strength[i]))
     plt.title(r'The biggest cluster dependent of $p$')
     plt.xlabel(r'$p$')
     plt.ylabel('average size of the biggest cluster')
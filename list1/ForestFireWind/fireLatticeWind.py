@@ -0,0 +1,286 @@
+import os
+import sys
+import numpy as np
+from functools import lru_cache
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from modelTools import NO_TREE, OCCUPIED, BURNING, EMPTY, MOORE, moore_any, jit
+
+
+def open_raster(value):
+    # a per-cell field given as the path of a .npy file, mapped instead of read; anything else as it is
+    if isinstance(value, (str, os.PathLike)):
+        return np.load(value, mmap_mode="r")
+    return value
+
+
+def draw_forest(L, p, rng, block=1024):
+    """
+    Forest at the start of a run: every cell holds a tree with probability p, the trees of row L-1 burn.
+
+    :param p: probability of a tree, the same for every cell, or L x L array of the fuel density of every
+        cell (e.g. a memory-mapped raster, see open_raster)
+    :param rng: numpy Generator; the random numbers are drawn block rows at a time, which gives the same
+        numbers as one call for the whole forest
+    :return: L x L uint8 lattice
+    """
+    lattice = np.empty((L, L), dtype=np.uint8)
+    for start in range(0, L, block):
+        stop = min(start + block, L)
+        density = p if np.ndim(p) == 0 else p[start:stop]
+        lattice[start:stop] = np.where(rng.random((stop - start, L)) <= density, OCCUPIED, NO_TREE)
+    lattice[L-1][lattice[L-1] == OCCUPIED] = BURNING
+    return lattice
+
+
+@lru_cache(maxsize=None)
+def wind_kernel(direction, strength):
+    """
+    Ignition probabilities of an occupied tree by the offset of its burning neighbour.
+
+    The rule of ForestFireModel: 0.5 for any burning neighbour, raised by half of the wind strength
+    if the burning neighbour is upwind (at tree - direction) and lowered by half of the strength
+    if it is downwind (at tree + direction). An upwind neighbour wins over a downwind one, which
+    wins over the others.
+    :param direction: tuple (x,y) - direction of the wind
+    :param strength: wind strength [0,1]
+    :return: list of ((dx, dy), probability), later entries override earlier ones
+    """
+    upwind = (-direction[0], -direction[1])
+    downwind = (direction[0], direction[1])
+    kernel = [((dx, dy), 0.5) for dx, dy in MOORE.tolist() if (dx, dy) not in (upwind, downwind)]
+    if downwind != (0, 0):
+        kernel.append((downwind, 0.5 - 0.5 * strength))
+        kernel.append((upwind, 0.5 + 0.5 * strength))
+    return kernel
+
+
+class WindField:
+    """
+    Wind blowing differently in every cell, with the ignition kernel of every cell computed once.
+
+    The rule is the one of wind_kernel, taken with the wind of the tree which may ignite: a burning
+    neighbour upwind of it (at tree - direction) ignites it with probability up = 0.5 + 0.5 strength,
+    one downwind (at tree + direction) with down = 0.5 - 0.5 strength, any other with 0.5. The kernel of
+    a cell is kept as the index of its upwind offset in MOORE (-1 without wind), up and down, so a
+    10**4 x 10**4 landscape takes 9 bytes per cell; with path the arrays are files mapped into memory,
+    computed block rows at a time, and open reuses them without computing them again.
+    """
+
+    def __init__(self, direction, strength, path=None, block=1024):
+        """
+        :param direction: tuple (x,y) for all cells, or L x L x 2 array of the direction in every cell
+            (components -1, 0 or 1), or the path of such a .npy file (see open_raster)
+        :param strength: wind strength [0,1] for all cells, or L x L array (or its .npy file)
+        :param path: optional directory to keep the kernel in (upwind.npy, up.npy and down.npy)
+        """
+        direction, strength = open_raster(direction), open_raster(strength)
+        shape = direction.shape[:2] if np.ndim(direction) == 3 else np.shape(strength)
+        arrays = {"upwind": np.int8, "up": np.float32, "down": np.float32}
+        if path is not None:
+            os.makedirs(path, exist_ok=True)
+            arrays = {name: np.lib.format.open_memmap(os.path.join(path, name + ".npy"), mode="w+", dtype=dtype,
+                                                      shape=shape) for name, dtype in arrays.items()}
+        else:
+            arrays = {name: np.empty(shape, dtype=dtype) for name, dtype in arrays.items()}
+        self.path = path
+        self.upwind, self.up, self.down = arrays["upwind"], arrays["up"], arrays["down"]
+        self.shape = shape
+
+        for start in range(0, shape[0], block):
+            stop = min(start + block, shape[0])
+            if np.ndim(direction) == 3:
+                dx, dy = np.asarray(direction[start:stop], dtype=np.int64).transpose(2, 0, 1)
+            else:
+                dx, dy = direction
+            # the upwind offset is -direction, (1 - dx) * 3 + (1 - dy) its index in the 3 x 3 block
+            self.upwind[start:stop] = _MOORE_INDEX[(1 - np.asarray(dx)) * 3 + (1 - np.asarray(dy))]
+            rows = strength if np.ndim(strength) == 0 else np.asarray(strength[start:stop])
+            self.up[start:stop] = 0.5 + 0.5 * rows
+            self.down[start:stop] = 0.5 - 0.5 * rows
+        if path is not None:
+            for array in arrays.values():
+                array.flush()
+
+    @classmethod
+    def open(cls, path):
+        # a field kept in path by an earlier WindField, mapped read-only
+        field = cls.__new__(cls)
+        field.path = path
+        field.upwind, field.up, field.down = [np.load(os.path.join(path, name + ".npy"), mmap_mode="r")
+                                              for name in ("upwind", "up", "down")]
+        field.shape = field.upwind.shape
+        return field
+
+    def kernel_at(self, pos):
+        # (upwind offset or None, up, down) of one cell, what TreeAgent.step needs
+        index = int(self.upwind[pos])
+        return (tuple(MOORE[index].tolist()) if index >= 0 else None), float(self.up[pos]), float(self.down[pos])
+
+    def probability(self, lattice, x, y):
+        # ignition probabilities of the trees (x, y), each with a burning neighbour; only their cells are read
+        rows, cols = lattice.shape
+        probability = np.full(len(x), 0.5)
+        upwind = np.asarray(self.upwind[x, y])
+        windy = np.flatnonzero(upwind >= 0)
+        offsets = MOORE[upwind[windy]]
+        for sign, values in ((1, self.down), (-1, self.up)):  # upwind last, it wins over downwind
+            nx, ny = x[windy] - sign * offsets[:, 0], y[windy] - sign * offsets[:, 1]
+            inside = (nx >= 0) & (nx < rows) & (ny >= 0) & (ny < cols)
+            source = np.zeros(len(windy), dtype=bool)
+            source[inside] = lattice[nx[inside], ny[inside]] == BURNING
+            cells = windy[source]
+            probability[cells] = values[x[cells], y[cells]]
+        return probability
+
+
+# index in MOORE of the offset at (dx + 1) * 3 + (dy + 1), -1 for (0, 0)
+_MOORE_INDEX = np.array([0, 1, 2, 3, -1, 4, 5, 6, 7], dtype=np.int8)
+_MOORE_DX, _MOORE_DY = MOORE[:, 0].copy(), MOORE[:, 1].copy()
+
+
+def wind_step(lattice, kernel, rng):
+    """
+    Advance the lattice by one step in place.
+
+    Every occupied tree with a burning neighbour draws one random number, all drawn in one batch,
+    and starts burning if it is not above the tree's ignition probability from the kernel.
+    :param kernel: kernel of wind_kernel, the same in every cell, or a WindField
+    :return: number of trees burning after the step
+    """
+    burning = lattice == BURNING
+    candidates = np.nonzero((lattice == OCCUPIED) & moore_any(burning))
+    if isinstance(kernel, WindField):
+        probability = kernel.probability(lattice, *candidates)
+    else:
+        padded = np.pad(burning, 1)
+        rows, cols = lattice.shape
+        probability = np.zeros(lattice.shape)
+        for (dx, dy), value in kernel:
+            probability[padded[1 + dx:1 + dx + rows, 1 + dy:1 + dy + cols]] = value
+        probability = probability[candidates]
+
+    ignite = rng.random(len(candidates[0])) <= probability
+    lattice[burning] = EMPTY
+    lattice[candidates[0][ignite], candidates[1][ignite]] = BURNING
+    return int(np.count_nonzero(ignite))
+
+
+def wind_block(halo, out, rng, kernel):
+    # wind_step of the rows halo[1:-1] written to out, the first and the last row only provide neighbours
+    burning = halo == BURNING
+    padded = np.pad(burning, [(0, 0), (1, 1)])  # the first and the last row already pad the block
+    rows, cols = out.shape
+    probability = np.zeros(out.shape)
+    for (dx, dy), value in kernel:
+        probability[padded[1 + dx:1 + dx + rows, 1 + dy:1 + dy + cols]] = value
+
+    candidates = np.nonzero((halo[1:-1] == OCCUPIED) & moore_any(burning)[1:-1])
+    ignite = rng.random(len(candidates[0])) <= probability[candidates]
+    out[:] = halo[1:-1]
+    out[burning[1:-1]] = EMPTY
+    out[candidates[0][ignite], candidates[1][ignite]] = BURNING
+    return int(np.count_nonzero(ignite))
+
+
+def wind_front_step(lattice, front, kernel, rng):
+    """
+    Advance the lattice by one step in place, visiting only the fire front.
+
+    :param kernel: kernel of wind_kernel or a WindField, as in wind_step
+    :param front: (rows, cols) of the burning trees, as returned by np.nonzero
+    :return: (rows, cols) of the trees burning after the step
+    """
+    rows, cols = lattice.shape
+    x = (front[0][:, None] + MOORE[:, 0]).ravel()
+    y = (front[1][:, None] + MOORE[:, 1]).ravel()
+    inside = (x >= 0) & (x < rows) & (y >= 0) & (y < cols)
+    x, y = x[inside], y[inside]
+    hit = lattice[x, y] == OCCUPIED
+    x, y = np.divmod(np.unique(x[hit] * cols + y[hit]), cols)
+
+    if isinstance(kernel, WindField):
+        probability = kernel.probability(lattice, x, y)
+    else:
+        probability = np.zeros(len(x))
+        for (dx, dy), value in kernel:
+            nx, ny = x + dx, y + dy
+            inside = (nx >= 0) & (nx < rows) & (ny >= 0) & (ny < cols)
+            source = np.zeros(len(x), dtype=bool)
+            source[inside] = lattice[nx[inside], ny[inside]] == BURNING
+            probability[source] = value
+
+    ignite = rng.random(len(x)) <= probability
+    lattice[front] = EMPTY
+    lattice[x[ignite], y[ignite]] = BURNING
+    return x[ignite], y[ignite]
+
+
+CANDIDATE = 4  # code of an occupied tree next to the fire during a jit step, before the step ends
+
+
+def _jit_wind_front(lattice, rows, cols, offsets, values, upwind, up, down, rng):
+    # compiled by jit_wind_front_step: one step from the burning trees (rows, cols), return the new front;
+    # the kernel is offsets and values (of wind_kernel), or upwind, up and down of a WindField if offsets is empty
+    height, width = lattice.shape
+    flat = np.empty(8 * len(rows), dtype=np.int64)
+    count = 0
+    for k in range(len(rows)):
+        for dx in range(-1, 2):
+            for dy in range(-1, 2):
+                x, y = rows[k] + dx, cols[k] + dy
+                if 0 <= x < height and 0 <= y < width and lattice[x, y] == OCCUPIED:
+                    lattice[x, y] = CANDIDATE
+                    flat[count] = x * width + y
+                    count += 1
+    flat = np.sort(flat[:count])
+
+    ignited = np.zeros(count, dtype=np.bool_)
+    for k in range(count):
+        x, y = flat[k] // width, flat[k] % width
+        probability = 0.0
+        if len(offsets):
+            for i in range(len(offsets)):  # later entries override earlier ones
+                nx, ny = x + offsets[i, 0], y + offsets[i, 1]
+                if 0 <= nx < height and 0 <= ny < width and lattice[nx, ny] == BURNING:
+                    probability = values[i]
+        else:
+            probability = 0.5
+            if upwind[x, y] >= 0:
+                dx, dy = _MOORE_DX[upwind[x, y]], _MOORE_DY[upwind[x, y]]
+                nx, ny = x - dx, y - dy
+                if 0 <= nx < height and 0 <= ny < width and lattice[nx, ny] == BURNING:
+                    probability = float(down[x, y])
+                nx, ny = x + dx, y + dy  # upwind wins over downwind
+                if 0 <= nx < height and 0 <= ny < width and lattice[nx, ny] == BURNING:
+                    probability = float(up[x, y])
+        ignited[k] = rng.random() <= probability
+
+    for k in range(len(rows)):
+        lattice[rows[k], cols[k]] = EMPTY
+    for k in range(count):
+        lattice[flat[k] // width, flat[k] % width] = BURNING if ignited[k] else OCCUPIED
+    flat = flat[ignited]
+    return flat // width, flat % width
+
+
+def jit_wind_front_step(lattice, front, kernel, rng):
+    """
+    wind_front_step compiled by numba: the same step, with the same random numbers for the same rng,
+    in one loop over the front without temporary arrays.
+
+    :param kernel: kernel of wind_kernel or a WindField, as in wind_step
+    :return: (rows, cols) of the trees burning after the step
+    """
+    rows, cols = front[0].astype(np.int64), front[1].astype(np.int64)
+    if isinstance(kernel, WindField):
+        offsets, values = np.zeros((0, 2), dtype=np.int64), np.zeros(0)
+        upwind, up, down = np.asarray(kernel.upwind), np.asarray(kernel.up), np.asarray(kernel.down)
+    else:
+        offsets = np.array([offset for offset, _ in kernel], dtype=np.int64).reshape(-1, 2)
+        values = np.array([value for _, value in kernel], dtype=np.float64)
+        upwind, up, down = np.zeros((0, 0), dtype=np.int8), np.zeros((0, 0), dtype=np.float32), \
+            np.zeros((0, 0), dtype=np.float32)
+    return jit(_jit_wind_front)(lattice, rows, cols, offsets, values, upwind, up, down, rng)
+
+
@@ -1,6 +1,11 @@
+import os
+import sys
 from mesa.visualization.modules import CanvasGrid
 from mesa.visualization.ModularVisualization import ModularServer
-from ForestFireFire import ForestFireModel
+from ForestFireWind import ForestFireModel
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "viewer"))
+from frames import FIRE_COLOURS
+from streamServer import StreamServer
 
 
 def agent_portrayal(agent):
@@ -23,13 +28,20 @@ def agent_portrayal(agent):
 
 L = 10
 p = 0.6
-
-grid = CanvasGrid(agent_portrayal, L, L, 500, 500)
-
-server = ModularServer(ForestFireModel,
-                       [grid],
-                       "Forest Fire Model",
-                       {"L": L, "p": p})
+direction = (1, 1)
+strength = 0.5
+
+if "--stream" in sys.argv:
+    # binary frames of the lattice instead of portrayals, keeps up with big forests (see viewer/streamServer)
+    server = StreamServer(ForestFireModel, {"L": 1000, "p": p, "direction": direction, "strength": strength,
+                                            "backend": "numpy"}, FIRE_COLOURS, "Forest Fire Model")
+else:
+    grid = CanvasGrid(agent_portrayal, L, L, 500, 500)
+
+    server = ModularServer(ForestFireModel,
+                           [grid],
+                           "Forest Fire Model",
+                           {"L": L, "p": p, "direction": direction, "strength": strength})
 
 server.port = 8521  # The default
 server.launch()
@@ -0,0 +1,109 @@
+import math
+import pandas as pd
+from sweep import iter_sweep
+
+
+def wilson(mean, n, z=1.96):
+    """
+    Wilson score interval of a proportion (or of the mean of values in [0, 1]) from n replicas.
+
+    Unlike mean +- z * standard error it does not shrink to nothing when every replica gives the same value.
+    :return: (low, high)
+    """
+    factor = z * z / n
+    centre = (mean + factor / 2) / (1 + factor)
+    half = z * math.sqrt(mean * (1 - mean) / n + factor / n / 4) / (1 + factor)
+    return centre - half, centre + half
+
+
+def estimate_mean(model_cls, kwargs, reporter, target_width=0.1, level=None, min_runs=10, max_runs=1000, batch=10,
+                  z=1.96, seed=None, values=None, **sweep_kwargs):
+    """
+    Mean of a reporter with values in [0, 1] (e.g. compute_p) over replicas, drawn in batches until its
+    confidence interval (see wilson) is narrow enough.
+
+    :param kwargs: model kwargs
+    :param reporter: function of the finished model, e.g. compute_p
+    :param target_width: stop when the whole interval is not wider
+    :param level: if given, also stop as soon as the interval lies above or below level, i.e. once it is
+        known on which side of level the mean is (a sequential test)
+    :param min_runs, max_runs: bounds of the number of replicas
+    :param batch: replicas run at a time (in parallel, see sweep.iter_sweep)
+    :param seed: if given, replicas get seeds seed, seed + 1, ...
+    :param values: values of the replicas already run with these kwargs and seed, continued from;
+        the new ones are appended to it
+    :param sweep_kwargs: passed to iter_sweep, e.g. processes, cache, max_steps
+    :return: (mean, half width of the interval, number of replicas)
+    """
+    values = [] if values is None else values
+    while len(values) < max_runs:
+        if len(values) >= min_runs:
+            low, high = wilson(sum(values) / len(values), len(values), z)
+            if high - low <= target_width or level is not None and (low > level or high < level):
+                break
+        count = min(batch, max_runs - len(values))
+        # every batch continues the numbering of the runs, so a cache gives back each replica only once
+        results = iter_sweep(model_cls, {}, kwargs, count, {"value": reporter}, seed=seed,
+                             first_run=len(values), **sweep_kwargs)
+        values += [result[2]["value"] for result in results]
+
+    mean = sum(values) / len(values)
+    low, high = wilson(mean, len(values), z)
+    return mean, (high - low) / 2, len(values)
+
+
+def find_threshold(model_cls, fixed_params, reporter, level=0.5, low=0.0, high=1.0, tolerance=0.01,
+                   seed=None, **kwargs):
+    """
+    Bisect p for the point where the mean of reporter (e.g. compute_p) crosses level.
+
+    For the percolation curve p* (0 below the threshold, 1 above) the crossing of 0.5 is its steepest
+    part. Every evaluated p draws replicas only until its confidence interval lies above or below level
+    (see estimate_mean), so points far from the threshold, where every run gives the same answer, are
+    cheap. The threshold is interpolated between the ends of the final bracket, whose intervals are
+    narrowed down to target_width.
+    :param fixed_params: model kwargs other than p, e.g. {"L": 50} or {"L": 25, "direction": (1, 1), "strength": 0.5}
+    :param tolerance: bisection stops when the bracket is narrower
+    :param kwargs: passed to estimate_mean, e.g. target_width, max_runs, processes, cache
+    :return: dict with "threshold", "error" (its standard error, from the width of the bracket and
+        the intervals of its ends), "runs" (replicas in total) and "points" (DataFrame of every
+        evaluated p with its mean, half width of the interval and number of replicas)
+    """
+    values = {}  # p -> values of its replicas
+    points = {}  # p -> its mean, half width of the interval and number of replicas
+
+    def evaluate(p, level=None):
+        if p not in values:
+            values[p] = []
+        point_seed = None if seed is None else seed + 1000003 * list(values).index(p)
+        mean, half, runs = estimate_mean(model_cls, dict(fixed_params, p=p), reporter, level=level,
+                                         seed=point_seed, values=values[p], **kwargs)
+        points[p] = {"p": p, "mean": mean, "half width": half, "runs": runs}
+        return mean, half
+
+    # the bisection only needs to know on which side of level every point is
+    evaluate(low, level)
+    evaluate(high, level)
+    while high - low > tolerance:
+        middle = (low + high) / 2
+        mean, _ = evaluate(middle, level)
+        if mean > level:
+            high = middle
+        else:
+            low = middle
+    # the ends of the final bracket, which give the threshold, to the width of target_width
+    low_mean, low_half = evaluate(low)
+    high_mean, high_half = evaluate(high)
+
+    bracket = (high - low) / math.sqrt(12)  # standard deviation of a point anywhere in the bracket
+    slope = (high_mean - low_mean) / (high - low)
+    if slope > 0:
+        threshold = min(max(low + (level - low_mean) / slope, low), high)
+        spread = max(low_half, high_half) / kwargs.get("z", 1.96) / slope
+        error = math.sqrt(bracket ** 2 + spread ** 2)
+    else:  # the ends are not told apart, the threshold is somewhere in the bracket
+        threshold = (low + high) / 2
+        error = high - low
+
+    points = pd.DataFrame(list(points.values())).sort_values("p", ignore_index=True)
+    return {"threshold": threshold, "error": error, "runs": int(points["runs"].sum()), "points": points}
@@ -0,0 +1,339 @@
+import json
+import multiprocessing
+from collections import Counter
+from contextlib import nullcontext
+from functools import wraps
+from multiprocessing import shared_memory
+from time import perf_counter
+import numpy as np
+import pandas as pd
+
+try:
+    from numba import njit
+except ImportError:  # numba is optional, only the "jit" backends need it
+    njit = None
+
+# Code shared by the models: ForestFire, ForestFireWind and the GameOfLife of list 3.
+
+# Cell codes of the uint8 lattice of the forest fires' "numpy" and "jit" backends.
+# EMPTY is a burnt-out tree, the same meaning as TreeAgent.status == "empty".
+NO_TREE = 0
+OCCUPIED = 1
+BURNING = 2
+EMPTY = 3
+
+STATUS = {OCCUPIED: "occupied", BURNING: "burning", EMPTY: "empty"}
+CODE = {status: code for code, status in STATUS.items()}
+
+# offsets of the Moore neighbourhood
+MOORE = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy])
+
+
+def moore_any(mask):
+    # True for every cell which has at least one True cell in its Moore neighbourhood,
+    # leading axes (e.g. replicas) are kept apart
+    padded = np.pad(mask, [(0, 0)] * (mask.ndim - 2) + [(1, 1), (1, 1)])
+    near = np.zeros_like(mask)
+    rows, cols = mask.shape[-2:]
+    for dx in (0, 1, 2):
+        for dy in (0, 1, 2):
+            if dx == 1 and dy == 1:
+                continue
+            near |= padded[..., dx:dx + rows, dy:dy + cols]
+    return near
+
+
+def count_perimeter(lattice, front):
+    """
+    :param front: (rows, cols) of the burning trees
+    :return: number of occupied trees with a burning neighbour
+    """
+    rows, cols = lattice.shape
+    x = (front[0][:, None] + MOORE[:, 0]).ravel()
+    y = (front[1][:, None] + MOORE[:, 1]).ravel()
+    inside = (x >= 0) & (x < rows) & (y >= 0) & (y < cols)
+    x, y = x[inside], y[inside]
+    hit = lattice[x, y] == OCCUPIED
+    return len(np.unique(x[hit] * cols + y[hit]))
+
+
+def label_clusters(mask, moore=False):
+    """
+    Label 4-connected (8-connected if moore) clusters of True cells.
+
+    Every cell points at a parent cell with a smaller index. Roots of neighbouring cells are hooked
+    onto the smaller of the two and pointers are jumped until every cell points at its root.
+    :return: int array with 0 outside the mask and the (1-based) index of the cluster's root inside
+    """
+    rows, cols = mask.shape
+    flat = mask.ravel()
+    parent = np.arange(rows * cols)
+    index = parent.reshape(rows, cols)
+    # pairs of neighbouring cells which are both in the mask
+    right = mask[:, :-1] & mask[:, 1:]
+    down = mask[:-1, :] & mask[1:, :]
+    a = [index[:, :-1][right], index[:-1, :][down]]
+    b = [index[:, 1:][right], index[1:, :][down]]
+    if moore:
+        diagonal = mask[:-1, :-1] & mask[1:, 1:]
+        antidiagonal = mask[:-1, 1:] & mask[1:, :-1]
+        a += [index[:-1, :-1][diagonal], index[:-1, 1:][antidiagonal]]
+        b += [index[1:, 1:][diagonal], index[1:, :-1][antidiagonal]]
+    a, b = np.concatenate(a), np.concatenate(b)
+
+    while True:
+        ra, rb = parent[a], parent[b]
+        differ = ra != rb
+        if not differ.any():
+            break
+        ra, rb = ra[differ], rb[differ]
+        np.minimum.at(parent, np.maximum(ra, rb), np.minimum(ra, rb))
+        while True:
+            jumped = parent[parent]
+            if np.array_equal(jumped, parent):
+                break
+            parent = jumped
+
+    return np.where(flat, parent + 1, 0).reshape(rows, cols)
+
+
+def cluster_sizes(lattice):
+    # sizes of 4-connected clusters of burnt trees, from the largest
+    counts = np.bincount(label_clusters(lattice == EMPTY).ravel())[1:]
+    return sorted(counts[counts > 0].tolist(), reverse=True)
+
+
+def count_unburnt(lattice):
+    return int(np.count_nonzero((lattice == OCCUPIED) | (lattice == BURNING)))
+
+
+JIT = njit is not None  # whether the "jit" backends can be used
+_compiled = {}
+
+
+def jit(function):
+    # function compiled by numba (on first use, cached on disk between runs)
+    if function not in _compiled:
+        if njit is None:
+            raise ValueError("The jit backend needs numba")
+        _compiled[function] = njit(cache=True)(function)
+    return _compiled[function]
+
+
+SNAPSHOT_MAGIC = b"ABMSNAP1"
+
+
+def save_snapshot(path, lattice, state):
+    """
+    Write a lattice and a JSON-able state to one binary file: magic, length of the header, the header
+    (state with the dtype and shape of the lattice) as JSON and the raw lattice, aligned to 64 bytes
+    so that load_snapshot maps it instead of reading it.
+    """
+    header = json.dumps(dict(state, dtype=lattice.dtype.str, shape=lattice.shape)).encode()
+    start = len(SNAPSHOT_MAGIC) + 8 + len(header)
+    with open(path, "wb") as snapshot:
+        snapshot.write(SNAPSHOT_MAGIC)
+        snapshot.write(len(header).to_bytes(8, "little"))
+        snapshot.write(header)
+        snapshot.write(bytes(-start % 64))
+        np.ascontiguousarray(lattice).tofile(snapshot)
+
+
+def load_snapshot(path, mode="c"):
+    """
+    :param mode: mode of the memory map of the lattice, by default copy-on-write: changes stay in memory
+        and many models can start from one file
+    :return: (lattice, state)
+    """
+    with open(path, "rb") as snapshot:
+        if snapshot.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+            raise ValueError("Not a snapshot: " + str(path))
+        length = int.from_bytes(snapshot.read(8), "little")
+        header = json.loads(snapshot.read(length))
+    start = len(SNAPSHOT_MAGIC) + 8 + length
+    lattice = np.memmap(path, dtype=np.dtype(header.pop("dtype")), mode=mode, offset=start + -start % 64,
+                        shape=tuple(header.pop("shape")))
+    return lattice, header
+
+
+class Tiles:
+    """
+    Lattice cut into strips of rows, each advanced by its own worker process, all in lockstep.
+
+    The lattice is kept twice in shared memory. In every step each worker reads its rows and the rows
+    just above and below them (its halo, wrapped around if torus, empty otherwise) from one copy and
+    writes its rows of the next state to the other; then the copies swap. So every step gives exactly
+    what kernel gives on the whole lattice, unless kernel draws random numbers: each strip then has
+    its own stream (seeded from seed).
+    :param kernel: module-level function (halo, out, rng, *args) writing the next state of the rows
+        halo[1:-1] to out and returning a count (e.g. of burning trees), summed over the strips by step
+    """
+
+    def __init__(self, lattice, kernel, processes, args=(), torus=False, seed=None):
+        context = multiprocessing.get_context()
+        self.memory = [shared_memory.SharedMemory(create=True, size=max(lattice.nbytes, 1)) for _ in range(2)]
+        self.copies = [np.ndarray(lattice.shape, lattice.dtype, buffer=memory.buf) for memory in self.memory]
+        self.copies[0][:] = lattice
+        self.current = 0
+        self.counts = context.Array("q", processes + 1, lock=False)  # count of every strip, the last one: stop
+        self.barrier = context.Barrier(processes + 1)
+        bounds = np.linspace(0, lattice.shape[0], processes + 1).astype(int)
+        seeds = np.random.SeedSequence(seed).spawn(processes)
+        names = [memory.name for memory in self.memory]
+        self.workers = [context.Process(target=_work, daemon=True, args=(
+            names, lattice.shape, lattice.dtype, bounds[i], bounds[i + 1], i, kernel, args, torus, seeds[i],
+            self.counts, self.barrier)) for i in range(processes)]
+        for worker in self.workers:
+            worker.start()
+
+    @property
+    def lattice(self):
+        # current state, a view of the shared memory valid until close
+        return self.copies[self.current]
+
+    def step(self):
+        self.barrier.wait()  # the workers start the step
+        self.barrier.wait()  # and all of them have finished it
+        self.current = 1 - self.current
+        return sum(self.counts[:-1])
+
+    def close(self):
+        # stop the workers and free the shared memory (views of lattice must be gone by then)
+        if self.workers:
+            self.counts[-1] = 1
+            self.barrier.wait()
+            for worker in self.workers:
+                worker.join()
+            self.workers = []
+            self.copies = []
+            for memory in self.memory:
+                memory.unlink()
+                try:
+                    memory.close()
+                except BufferError:  # a view of the lattice is still alive, the memory goes with it
+                    pass
+
+
+def _work(names, shape, dtype, start, stop, index, kernel, args, torus, seed, counts, barrier):
+    memory = [shared_memory.SharedMemory(name=name) for name in names]
+    copies = [np.ndarray(shape, dtype, buffer=part.buf) for part in memory]
+    rng = np.random.default_rng(seed)
+    rows = shape[0]
+    current = 0
+    source = halo = None
+    while True:
+        barrier.wait()
+        if counts[-1]:
+            break
+        source = copies[current]
+        if 0 < start and stop < rows:
+            halo = source[start - 1:stop + 1]
+        elif torus:
+            halo = source.take(np.arange(start - 1, stop + 1) % rows, axis=0)
+        else:
+            halo = np.zeros((stop - start + 2,) + shape[1:], dtype)
+            halo[1:-1] = source[start:stop]
+            if start > 0:
+                halo[0] = source[start - 1]
+            if stop < rows:
+                halo[-1] = source[stop]
+        counts[index] = kernel(halo, copies[1 - current][start:stop], rng, *args)
+        barrier.wait()
+        current = 1 - current
+    del source, halo, copies
+    for part in memory:
+        part.close()
+
+
+# The agents of the "agents" backends (TreeAgent of the forest fires, Cell of the Game of Life) are not
+# subclasses of Mesa's Agent: it has no __slots__, so every instance would still carry a __dict__. They only
+# have its interface (unique_id, model, pos, random, step, advance). The other backends hold no agents,
+# their BaseScheduler only counts the steps for BatchRunner.
+# model.phase(name) is a context timing a phase of the run (see Profile) if the model is instrumented,
+# NO_PHASE otherwise.
+NO_PHASE = nullcontext()  # phase of a model which is not instrumented
+
+
+class Profile:
+    """
+    Instrumentation of one run: wall time of its phases, number of steps and cells touched by each step.
+
+    Phases of the forest fires: "init" (drawing the forest and placing the agents), "step" (the update
+    itself), "scan" (the search for burning trees), "record" (see Recorder), "reporters"
+    (DataCollector.collect) and one per reporter function called on the model, e.g. "compute_cluster",
+    whoever calls it (BatchRunner or the sweeps too). Phases nest, e.g. "reporters" includes the
+    reporters it calls.
+    Phases of the Game of Life: "init" (building the board), "step" (the generations themselves), "cycle"
+    (hashing the board and looking it up, see GameOfLife.detect_cycle), "record" and "cells" (reading
+    the board out, e.g. by the visualization).
+    """
+
+    def __init__(self):
+        self.times = Counter()  # phase -> seconds
+        self.calls = Counter()  # phase -> number of times it was timed
+        self.touched = []  # cells touched by each step
+
+    def phase(self, name):
+        return _Phase(self, name)
+
+    def summary(self):
+        # totals of the run as one flat dict, a row of a DataFrame
+        summary = {}
+        for name in sorted(self.times):
+            summary[name + " time"] = self.times[name]
+            summary[name + " calls"] = self.calls[name]
+        summary["steps"] = len(self.touched)
+        summary["cells touched"] = sum(self.touched)
+        summary["cells touched per step"] = summary["cells touched"] / len(self.touched) if self.touched else 0
+        return summary
+
+
+class _Phase:
+    __slots__ = ("profile", "name", "start")
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.start = perf_counter()
+
+    def __exit__(self, *exc):
+        self.profile.times[self.name] += perf_counter() - self.start
+        self.profile.calls[self.name] += 1
+
+
+class Recorder:
+    """
+    Values of every step of a run, kept in preallocated numpy columns which double their length when full,
+    so recording a step creates no Python objects beyond its row of values.
+    """
+
+    def __init__(self, columns, capacity=256):
+        self.columns = {name: i for i, name in enumerate(columns)}
+        self.data = np.empty((len(columns), capacity), dtype=np.int64)  # one row per column
+        self.size = 0
+
+    def append(self, *values):
+        if self.size == self.data.shape[1]:
+            data = np.empty((self.data.shape[0], 2 * self.size), dtype=self.data.dtype)
+            data[:, :self.size] = self.data
+            self.data = data
+        self.data[:, self.size] = values
+        self.size += 1
+
+    def last(self, name):
+        return int(self.data[self.columns[name], self.size - 1])
+
+    def frame(self):
+        # DataFrame with one row per recorded step
+        return pd.DataFrame({name: self.data[i, :self.size] for name, i in self.columns.items()})
+
+
+def timed(reporter):
+    # time every call of a reporter function as a phase of the model's profile
+    @wraps(reporter)
+    def timed_reporter(model):
+        with model.phase(reporter.__name__):
+            return reporter(model)
+    return timed_reporter
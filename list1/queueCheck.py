@@ -0,0 +1,44 @@
+import multiprocessing
+import os
+import sys
+import tempfile
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "ForestFire"))
+from ForestFireModel import ForestFireModel, compute_p
+from sweep import run_sweep
+from workQueue import open_queue, work
+
+
+def failing(model):
+    # reporter which raises for the densest forests
+    if model.p > 0.5:
+        raise ArithmeticError("failing reporter")
+    return compute_p(model)
+
+
+def crossCheck(url, authkey=None):
+    # a raising reporter has to fail the sweep, not the worker, which then runs the next sweep
+    queue = open_queue(url, authkey=authkey)
+    worker = multiprocessing.Process(target=work, args=(open_queue(url, worker=True, authkey=authkey),),
+                                     kwargs={"poll": 0.1}, daemon=True)
+    worker.start()
+    fixed = {"L": 10, "backend": "numpy"}
+    try:
+        run_sweep(ForestFireModel, {"p": [0.4, 0.6]}, fixed, 2, {"p*": failing}, queue=queue, seed=1)
+    except RuntimeError as error:
+        if "ArithmeticError: failing reporter" not in str(error):
+            raise AssertionError("{}: the error does not hold the worker's traceback: {}".format(url, error))
+    else:
+        raise AssertionError("{}: the sweep did not fail".format(url))
+    data = run_sweep(ForestFireModel, {"p": [0.4, 0.6]}, fixed, 2, {"p*": compute_p}, queue=queue, seed=1)
+    if len(data) != 4 or not worker.is_alive():
+        raise AssertionError("{}: the worker did not go on after the failing task".format(url))
+    queue.close()
+    worker.join()
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as directory:
+        crossCheck("file:" + directory)
+    crossCheck("socket::5801", authkey="check")
+    print("failing tasks fail their sweep and the workers go on")
@@ -0,0 +1,163 @@
+import glob
+import hashlib
+import importlib
+import inspect
+import json
+import os
+import sys
+import time
+import uuid
+import numpy as np
+
+# cache shared by the sweep scripts of list1
+DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+
+
+def _plain(value):
+    # parameter value as a plain python value, so that e.g. np.float64(0.5) and 0.5 give the same key
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, (tuple, list)):
+        return tuple(_plain(item) for item in value)
+    return value
+
+
+def _column(values):
+    # numeric column if every value is a number, otherwise a column of JSON strings (never a pickle, which
+    # could run any code when a chunk of a shared cache is loaded)
+    if all(isinstance(value, (bool, int, float, np.number, np.bool_)) for value in values):
+        return np.array(values)
+    try:
+        return np.array([json.dumps(_plain(value)) for value in values], dtype=str)
+    except TypeError:
+        raise ValueError("Only numbers and JSON values can be cached: " + repr(values)) from None
+
+
+def code_version(model_cls):
+    """
+    Hash of the source of the model's module and of the modules named by its SOURCES (e.g. its lattice
+    module and modelTools), in that order, whatever else has been imported.
+
+    Scripts (e.g. the plotting scripts) are not among them, so changing a plot does not invalidate the results.
+    """
+    module = sys.modules[model_cls.__module__]
+    digest = hashlib.sha1()
+    for source in [module] + [importlib.import_module(name) for name in getattr(module, "SOURCES", [])]:
+        with open(source.__file__, "rb") as code:
+            digest.update(code.read())
+    return digest.hexdigest()[:16]
+
+
+def reporter_version(reporter):
+    """
+    Hash of a reporter function: its module, qualified name and source.
+
+    code_version leaves scripts out, so reporters defined in them (e.g. those of finiteSize) are told
+    apart by this; editing one invalidates only its own results.
+    """
+    try:
+        source = inspect.getsource(reporter)
+    except (OSError, TypeError):  # no source to read, e.g. a builtin
+        source = ""
+    text = "{}.{}\n{}".format(getattr(reporter, "__module__", ""),
+                              getattr(reporter, "__qualname__", type(reporter).__qualname__), source)
+    return hashlib.sha1(text.encode()).hexdigest()[:16]
+
+
+class ResultCache:
+    """
+    On-disk store of model runs' reporters, kept as compressed columnar .npz chunks.
+
+    Results are grouped in directories by model class and code version; every chunk holds a column
+    of keys and one column per reporter, named by the reporter and its version (see reporter_version).
+    Results are buffered and written every flush_every results, so an interrupted sweep keeps what it
+    has done and the next run resumes from there. Chunks are read in the order they were written.
+    With max_bytes, the least recently used chunks are deleted once the cache grows past it.
+    """
+
+    def __init__(self, path=DEFAULT_PATH, max_bytes=2 ** 30, flush_every=100):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.flush_every = flush_every
+        self.loaded = {}  # directory -> {key: {reporter: value}}
+        self.pending = {}  # directory -> list of (key, {reporter: value})
+
+    def directory(self, model_cls, version):
+        return os.path.join(self.path, model_cls.__module__ + "." + model_cls.__qualname__, version)
+
+    @staticmethod
+    def key(kwargs, run):
+        # key of one run: model kwargs (with the seed) and the run number
+        text = repr(sorted((name, _plain(value)) for name, value in kwargs.items())) + "#" + str(run)
+        return hashlib.sha1(text.encode()).hexdigest()
+
+    def _results(self, directory):
+        if directory not in self.loaded:
+            results = {}
+            for chunk in sorted(glob.glob(os.path.join(directory, "chunk-*.npz"))):
+                with np.load(chunk) as data:
+                    columns = {}
+                    for name in data.files:
+                        try:
+                            columns[name] = data[name]
+                        except ValueError:  # a pickled column, of an older version of the cache
+                            pass
+                    keys = columns.pop("key")
+                    for i, key in enumerate(keys):
+                        results.setdefault(str(key), {}).update(
+                            (name, json.loads(column[i]) if column.dtype.kind == "U" else column[i].item())
+                            for name, column in columns.items())
+                os.utime(chunk)  # mark as recently used
+            self.loaded[directory] = results
+        return self.loaded[directory]
+
+    @staticmethod
+    def columns(reporters):
+        # column of every reporter, by its name: {name: function} -> {name: column}
+        return {name: name + "@" + reporter_version(reporter) for name, reporter in reporters.items()}
+
+    def get(self, directory, key, reporters):
+        # reporters ({name: function}) of a cached run, None unless every one of the reporters is cached
+        values = self._results(directory).get(key)
+        columns = self.columns(reporters)
+        if values is None or any(column not in values for column in columns.values()):
+            return None
+        return {name: values[column] for name, column in columns.items()}
+
+    def put(self, directory, key, values, reporters):
+        # values ({name: value}) of the reporters ({name: function}) of a run
+        columns = self.columns(reporters)
+        values = {columns[name]: value for name, value in values.items()}
+        self._results(directory).setdefault(key, {}).update(values)
+        self.pending.setdefault(directory, []).append((key, values))
+        if len(self.pending[directory]) >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        pending, self.pending = self.pending, {}  # a value which cannot be written is not tried again
+        for directory, entries in pending.items():
+            if not entries:
+                continue
+            os.makedirs(directory, exist_ok=True)
+            columns = {"key": np.array([key for key, _ in entries])}
+            for name in sorted({name for _, values in entries for name in values}):
+                columns[name] = _column([values.get(name) for _, values in entries])
+            # names sort in the order of writing, and are unique even after evictions or from other processes
+            name = os.path.join(directory, "chunk-{:020d}-{}.npz".format(time.time_ns(), uuid.uuid4().hex[:12]))
+            with open(name + ".tmp", "wb") as chunk:
+                np.savez_compressed(chunk, **columns)
+            os.replace(name + ".tmp", name)
+        self.evict()
+
+    def evict(self):
+        # delete the least recently used chunks until the cache fits in max_bytes
+        if self.max_bytes is None:
+            return
+        chunks = sorted(glob.glob(os.path.join(self.path, "*", "*", "chunk-*.npz")), key=os.path.getmtime)
+        total = sum(os.path.getsize(chunk) for chunk in chunks)
+        for chunk in chunks:
+            if total <= self.max_bytes:
+                break
+            total -= os.path.getsize(chunk)
+            os.remove(chunk)
+            self.loaded.pop(os.path.dirname(chunk), None)
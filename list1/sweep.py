@@ -0,0 +1,180 @@
+import itertools
+import multiprocessing
+import time
+import traceback
+import uuid
+import pandas as pd
+from resultCache import code_version
+
+
+def default_cost(params):
+    # bigger grids first, denser forests (longer fires) first among equal grids
+    return params.get("L", 0) ** 2, params.get("p", 0)
+
+
+def make_tasks(variable_params, fixed_params, iterations, seed=None, first_run=0):
+    """
+    Flatten the whole sweep into one task per model run, numbered in BatchRunner's order from first_run.
+
+    :return: list of (run, kwargs) - kwargs are passed to the model class
+    """
+    names = list(variable_params.keys())
+    tasks = []
+    run = first_run
+    for values in itertools.product(*variable_params.values()):
+        for _ in range(iterations):
+            kwargs = dict(zip(names, values))
+            kwargs.update(fixed_params)
+            if seed is not None:
+                kwargs["seed"] = seed + run
+            tasks.append((run, kwargs))
+            run += 1
+    return tasks
+
+
+def run_task(model_cls, kwargs, model_reporters, max_steps=1000):
+    # run one model to the end, as BatchRunner does, and return its reporters
+    model = model_cls(**kwargs)
+    while model.running and model.schedule.steps < max_steps:
+        model.step()
+    return {name: reporter(model) for name, reporter in model_reporters.items()}
+
+
+def _run_task(args):
+    run, model_cls, kwargs, model_reporters, max_steps = args
+    return run, kwargs, run_task(model_cls, kwargs, model_reporters, max_steps)
+
+
+class TaskFailure(str):
+    """
+    Traceback of a task which raised on a worker of a queue, pushed back to the coordinator as its result.
+    """
+
+
+def _run_queued(args):
+    # _run_task on a worker of a queue: the worker goes on after a failing task, whose traceback is its result
+    try:
+        return _run_task(args)
+    except Exception:
+        return TaskFailure(traceback.format_exc())
+
+
+def iter_sweep(model_cls, variable_params, fixed_params, iterations, model_reporters,
+               max_steps=1000, processes=None, cost=default_cost, seed=None, cache=None, queue=None, authkey=None,
+               first_run=0):
+    """
+    Run every (parameters, iteration) of a sweep as a separate task on a process pool.
+
+    Tasks are submitted from the most to the least expensive (by cost(kwargs)), so the long runs
+    start first and the short ones fill the gaps at the end, and results are yielded as soon as
+    each run finishes.
+    :param model_cls: model class, e.g. ForestFireModel of ForestFire or of ForestFireWind
+    :param variable_params, fixed_params, iterations, model_reporters, max_steps: as in BatchRunner
+    :param processes: size of the pool, all cores by default, 1 runs in this process
+    :param cost: function of the model kwargs giving a sortable estimate of the run's cost
+    :param seed: if given, run number n gets seed + n
+    :param first_run: number of the first run, e.g. to continue a sweep with new runs (and new cache entries)
+    :param cache: optional ResultCache; runs found in it (same model, kwargs, run number, max_steps,
+        code version and reporter versions) are not run again, new results are written to it as they come
+    :param queue: optional work queue (see workQueue), or its url (see workQueue.open_queue); the tasks are
+        published to it and run by workers on any node instead of the pool, tasks of dead workers are run again.
+        A task raising on a worker fails the sweep with a RuntimeError holding the worker's traceback.
+        A queue opened from a url is kept for the later sweeps of this process.
+    :param authkey: secret key of a socket queue given by url, by default from the environment
+        (see workQueue.secret_key)
+    :return: generator of (run, kwargs, reporters)
+    """
+    tasks = make_tasks(variable_params, fixed_params, iterations, seed, first_run)
+    tasks.sort(key=lambda task: cost(task[1]), reverse=True)
+
+    if cache is not None:
+        directory = cache.directory(model_cls, code_version(model_cls) + "-" + str(max_steps))
+        todo = []
+        for run, kwargs in tasks:
+            values = cache.get(directory, cache.key(kwargs, run), model_reporters)
+            if values is None:
+                todo.append((run, kwargs))
+            else:
+                yield run, kwargs, values
+        tasks = todo
+
+    args = [(run, model_cls, kwargs, model_reporters, max_steps) for run, kwargs in tasks]
+    if isinstance(queue, str):
+        queue = _open_queue(queue, authkey)
+    try:
+        results = _run_all(args, processes) if queue is None else _run_queue(args, queue)
+        for run, kwargs, values in results:
+            if cache is not None:
+                cache.put(directory, cache.key(kwargs, run), values, model_reporters)
+            yield run, kwargs, values
+    finally:
+        if cache is not None:
+            cache.flush()
+
+
+def _run_all(args, processes):
+    if processes == 1:
+        for arg in args:
+            yield _run_task(arg)
+        return
+
+    with multiprocessing.Pool(processes) as pool:
+        for result in pool.imap_unordered(_run_task, args):
+            yield result
+
+
+_queues = {}  # queues opened from their urls, a socket queue keeps its port until the process exits
+
+
+def _open_queue(url, authkey):
+    if url not in _queues:
+        from workQueue import open_queue  # workQueue imports this module
+        _queues[url] = open_queue(url, authkey=authkey)
+    return _queues[url]
+
+
+def _run_queue(args, queue, poll=1.0):
+    # publish the tasks and yield the results as the workers push them, each once even if a task ran twice
+    sweep = uuid.uuid4().hex[:12]
+    tasks = [("{}-{:08d}".format(sweep, i), arg) for i, arg in enumerate(args)]  # ids sort as the tasks
+    waiting = {task_id for task_id, _ in tasks}
+    queue.publish(tasks)
+    try:
+        while waiting:
+            results = [(task_id, result) for task_id, result in queue.collect(sweep) if task_id in waiting]
+            for task_id, result in results:
+                if isinstance(result, TaskFailure):
+                    raise RuntimeError("Task {} failed on a worker:\n{}".format(task_id, result))
+                waiting.discard(task_id)
+                yield result
+            if not results:
+                queue.requeue()
+                time.sleep(poll)
+    finally:
+        queue.discard(sweep)
+
+
+def to_dataframe(results, variable_params, fixed_params):
+    """
+    :param results: (run, kwargs, reporters) of the finished runs
+    :return: DataFrame with the columns of BatchRunner.get_model_vars_dataframe()
+    """
+    records = []
+    reporters = set()
+    for run, kwargs, values in results:
+        record = {name: kwargs[name] for name in variable_params}
+        record["Run"] = run
+        record.update(values)
+        reporters.update(values)
+        records.append(record)
+    columns = list(variable_params) + ["Run"] + sorted(reporters)
+    data = pd.DataFrame(records, columns=columns).sort_values(by="Run", ignore_index=True)
+    for name, value in fixed_params.items():
+        data[name] = [value] * len(data)
+    return data
+
+
+def run_sweep(model_cls, variable_params, fixed_params, iterations, model_reporters, **kwargs):
+    # run the whole sweep (see iter_sweep) and return its DataFrame
+    results = iter_sweep(model_cls, variable_params, fixed_params, iterations, model_reporters, **kwargs)
+    return to_dataframe(results, variable_params, fixed_params)
@@ -0,0 +1,374 @@
+"""
+Work queues for running a sweep on several machines: the coordinator (a sweep script, see sweep.iter_sweep
+with queue) publishes its tasks, workers on any node take them in batches and push back the results.
+Workers unpickle the model classes and reporters by module name, so every node needs the same code.
+
+    python list1/workQueue.py file:/shared/queue [--batch 4] [--processes 8]
+    ABM_QUEUE_KEY_FILE=~/.abm-queue-key python list1/workQueue.py socket:coordinator-host:5800
+
+Both backends have the same methods: publish, collect, requeue, discard and close for the coordinator,
+take, finish and beat for the workers. Workers send a heartbeat while they work; tasks taken by a worker
+silent for longer than lease seconds are put back into the queue and run by another one.
+
+Tasks and results are pickles, so whoever can talk to a queue can make the other side run any code. A socket
+queue therefore needs a secret key shared by the coordinator and its workers (see secret_key), there is
+no default one, and it listens on 127.0.0.1 unless the url names a host, e.g. socket:0.0.0.0:5800.
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import pickle
+import socket
+import sys
+import threading
+import time
+import uuid
+from collections import deque
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for directory in [("list1",), ("list1", "ForestFire"), ("list1", "ForestFireWind"), ("list 3",)]:
+    sys.path.append(os.path.join(ROOT, *directory))
+
+from sweep import _run_queued
+
+PORT = 5800
+HOST = "127.0.0.1"  # host of a socket url without one
+KEY_ENV = "ABM_QUEUE_KEY"  # secret key of a socket queue
+KEY_FILE_ENV = "ABM_QUEUE_KEY_FILE"  # or the path of a file holding it
+
+
+def secret_key(key=None, key_file=None):
+    """
+    Secret key of a socket queue: key, else the contents of key_file, else $ABM_QUEUE_KEY, else the contents
+    of the file named by $ABM_QUEUE_KEY_FILE (surrounding whitespace stripped).
+
+    :raise ValueError: if none of them gives a key
+    """
+    if key is None and key_file is None:
+        key = os.environ.get(KEY_ENV)
+        if key is None:
+            key_file = os.environ.get(KEY_FILE_ENV)
+    if key is None and key_file is not None:
+        with open(os.path.expanduser(key_file), "rb") as file:
+            key = file.read().strip()
+    if isinstance(key, str):
+        key = key.encode()
+    if not key:
+        raise ValueError("A socket queue needs a secret key: set {} or {}, or pass it".format(KEY_ENV, KEY_FILE_ENV))
+    return key
+
+
+class FileQueue:
+    """
+    Queue kept as files in a directory, e.g. on a file system shared by the nodes.
+
+    A task is a file in todo/; a worker takes it by renaming it into claimed/<worker>/ (a rename is atomic,
+    so only one worker gets it) and writes the result into done/. The heartbeat of a worker is the
+    modification time of workers/<worker>, so the clocks of the nodes should agree to well within lease.
+    """
+
+    def __init__(self, path, lease=60.0):
+        self.path = path
+        self.lease = lease
+        for name in ("todo", "claimed", "done", "workers"):
+            os.makedirs(os.path.join(path, name), exist_ok=True)
+
+    def _write(self, path, value):
+        # write, then rename, so that nobody reads a half written file
+        temporary = os.path.join(os.path.dirname(path), "." + os.path.basename(path) + "." + uuid.uuid4().hex)
+        with open(temporary, "wb") as file:
+            pickle.dump(value, file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, path)
+
+    @staticmethod
+    def _read(path):
+        with open(path, "rb") as file:
+            return pickle.load(file)
+
+    def publish(self, tasks):
+        # tasks: (task id, payload), taken in the order of their ids
+        for task_id, payload in tasks:
+            self._write(os.path.join(self.path, "todo", task_id + ".task"), payload)
+
+    def collect(self, prefix=""):
+        # (task id, result) of the finished tasks whose ids start with prefix, each returned once
+        results = []
+        for path in sorted(glob.glob(os.path.join(self.path, "done", prefix + "*.result"))):
+            results.append((os.path.basename(path)[:-len(".result")], self._read(path)))
+            os.remove(path)
+        return results
+
+    def requeue(self):
+        # put back the tasks of the workers silent for longer than lease, return how many
+        count = 0
+        now = time.time()
+        for claimed in glob.glob(os.path.join(self.path, "claimed", "*")):
+            beat = os.path.join(self.path, "workers", os.path.basename(claimed))
+            if os.path.exists(beat) and now - os.path.getmtime(beat) <= self.lease:
+                continue
+            for path in glob.glob(os.path.join(claimed, "*.task")):
+                name = os.path.basename(path)
+                try:
+                    if os.path.exists(os.path.join(self.path, "done", name[:-len(".task")] + ".result")):
+                        os.remove(path)
+                    else:
+                        os.rename(path, os.path.join(self.path, "todo", name))
+                        count += 1
+                except FileNotFoundError:  # the worker finished it after all
+                    pass
+        return count
+
+    def discard(self, prefix):
+        # drop the tasks and results of an abandoned (or finished) sweep
+        for pattern in (("todo", prefix + "*.task"), ("claimed", "*", prefix + "*.task"),
+                        ("done", prefix + "*.result")):
+            for path in glob.glob(os.path.join(self.path, *pattern)):
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+
+    def close(self):
+        # workers stop when they next ask for tasks
+        open(os.path.join(self.path, "closed"), "w").close()
+
+    def take(self, worker, count):
+        # up to count tasks, [] if there are none now, None if the queue is closed
+        if os.path.exists(os.path.join(self.path, "closed")):
+            return None
+        self.beat(worker)
+        claimed = os.path.join(self.path, "claimed", worker)
+        os.makedirs(claimed, exist_ok=True)
+        tasks = []
+        for name in sorted(os.listdir(os.path.join(self.path, "todo"))):
+            if len(tasks) == count:
+                break
+            if name.startswith("."):
+                continue
+            try:
+                os.rename(os.path.join(self.path, "todo", name), os.path.join(claimed, name))
+            except FileNotFoundError:  # taken by another worker
+                continue
+            tasks.append((name[:-len(".task")], self._read(os.path.join(claimed, name))))
+        return tasks
+
+    def finish(self, worker, results):
+        for task_id, result in results:
+            self._write(os.path.join(self.path, "done", task_id + ".result"), result)
+            try:
+                os.remove(os.path.join(self.path, "claimed", worker, task_id + ".task"))
+            except FileNotFoundError:  # requeued meanwhile, the duplicate is ignored by the coordinator
+                pass
+
+    def beat(self, worker):
+        path = os.path.join(self.path, "workers", worker)
+        with open(path, "a"):
+            os.utime(path)
+
+
+class SocketQueue:
+    """
+    Queue kept in the memory of the coordinator, which serves it to the workers over TCP.
+
+    Workers connect with SocketClient (pickled messages, authenticated with authkey, see secret_key). The queue
+    lives as long as the coordinator; when it exits, workers find the connection closed and stop.
+    """
+
+    def __init__(self, address=(HOST, PORT), authkey=None, lease=60.0):
+        self.lease = lease
+        self.lock = threading.Lock()
+        self.todo = deque()  # (task id, payload)
+        self.claimed = {}  # task id -> (worker, payload)
+        self.beats = {}  # worker -> time of its last heartbeat
+        self.done = {}  # task id -> result
+        self.closed = False
+        self.listener = Listener(address, authkey=secret_key(authkey))
+        self.address = self.listener.address
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def _serve(self):
+        while True:
+            try:
+                connection = self.listener.accept()
+            except AuthenticationError:
+                continue
+            except OSError:  # closed listener
+                return
+            threading.Thread(target=self._handle, args=(connection,), daemon=True).start()
+
+    def _handle(self, connection):
+        # one worker: calls (method name, args) and their answers
+        with connection:
+            while True:
+                try:
+                    name, args = connection.recv()
+                except (EOFError, OSError):
+                    return
+                if name not in ("take", "finish", "beat"):
+                    raise ValueError("Unknown call: " + str(name))
+                connection.send(getattr(self, name)(*args))
+
+    def publish(self, tasks):
+        with self.lock:
+            self.todo.extend(tasks)
+
+    def collect(self, prefix=""):
+        with self.lock:
+            ids = [task_id for task_id in self.done if task_id.startswith(prefix)]
+            return [(task_id, self.done.pop(task_id)) for task_id in ids]
+
+    def requeue(self):
+        with self.lock:
+            now = time.time()
+            dead = [task_id for task_id, (worker, _) in self.claimed.items()
+                    if now - self.beats.get(worker, 0) > self.lease]
+            for task_id in dead:
+                self.todo.appendleft((task_id, self.claimed.pop(task_id)[1]))
+            return len(dead)
+
+    def discard(self, prefix):
+        with self.lock:
+            self.todo = deque(task for task in self.todo if not task[0].startswith(prefix))
+            for tasks in (self.claimed, self.done):
+                for task_id in [task_id for task_id in tasks if task_id.startswith(prefix)]:
+                    del tasks[task_id]
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+
+    def take(self, worker, count):
+        with self.lock:
+            if self.closed:
+                return None
+            self.beats[worker] = time.time()
+            tasks = [self.todo.popleft() for _ in range(min(count, len(self.todo)))]
+            for task_id, payload in tasks:
+                self.claimed[task_id] = (worker, payload)
+            return tasks
+
+    def finish(self, worker, results):
+        with self.lock:
+            for task_id, result in results:
+                if self.claimed.pop(task_id, None) is not None:
+                    self.done[task_id] = result
+
+    def beat(self, worker):
+        with self.lock:
+            self.beats[worker] = time.time()
+
+
+class SocketClient:
+    # the worker side of a SocketQueue: take, finish and beat are called on the coordinator
+
+    def __init__(self, address, authkey=None):
+        self.connection = Client(address, authkey=secret_key(authkey))
+        self.lock = threading.Lock()  # the heartbeat comes from another thread
+
+    def _call(self, name, *args):
+        # None once the coordinator is gone: take then stops the worker, results have nowhere to go
+        with self.lock:
+            try:
+                self.connection.send((name, args))
+                return self.connection.recv()
+            except (EOFError, OSError):
+                return None
+
+    def take(self, worker, count):
+        return self._call("take", worker, count)
+
+    def finish(self, worker, results):
+        self._call("finish", worker, results)
+
+    def beat(self, worker):
+        self._call("beat", worker)
+
+
+def open_queue(url, worker=False, lease=60.0, authkey=None, key_file=None):
+    """
+    :param url: "file:<directory>" or "socket:<host>:<port>", the host is 127.0.0.1 if left out ("socket::5800")
+    :param worker: the worker side of the queue; for a socket that is a SocketClient connected to the
+        coordinator, which serves the queue on the port of url
+    :param authkey, key_file: secret key of a socket queue, see secret_key
+    """
+    kind, _, location = url.partition(":")
+    if kind == "file":
+        return FileQueue(location, lease)
+    if kind == "socket":
+        host, _, port = location.rpartition(":")
+        address = (host or HOST, int(port))
+        authkey = secret_key(authkey, key_file)
+        if worker:
+            return SocketClient(address, authkey)
+        return SocketQueue(address, authkey, lease)
+    raise ValueError("Unknown queue: " + str(url))
+
+
+def _beat(queue, worker, interval, stop):
+    while not stop.wait(interval):
+        queue.beat(worker)
+
+
+def work(queue, worker=None, batch=4, processes=1, idle=None, poll=1.0, beat=10.0):
+    """
+    Take batches of tasks from the queue and run them until the queue is closed.
+
+    :param worker: name of the worker, host name and process id by default
+    :param processes: if more than 1, the tasks of a batch run on a pool of that many processes
+    :param idle: stop after so many seconds without tasks (never by default)
+    :param beat: seconds between heartbeats, well below the lease of the queue
+    :return: number of tasks run
+    """
+    worker = worker or "{}-{}".format(socket.gethostname(), os.getpid())
+    stop = threading.Event()
+    threading.Thread(target=_beat, args=(queue, worker, beat, stop), daemon=True).start()
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+    count = 0
+    last = time.time()
+    try:
+        while True:
+            tasks = queue.take(worker, batch)
+            if tasks is None:
+                break
+            if not tasks:
+                if idle is not None and time.time() - last > idle:
+                    break
+                time.sleep(poll)
+                continue
+            ids = [task_id for task_id, _ in tasks]
+            payloads = [payload for _, payload in tasks]
+            # a task which raises gives its traceback as the result (see sweep.TaskFailure), the worker goes on
+            results = pool.imap(_run_queued, payloads) if pool else map(_run_queued, payloads)
+            for task_id, result in zip(ids, results):
+                queue.finish(worker, [(task_id, result)])  # one by one, so a crash loses only the rest
+                count += 1
+            last = time.time()
+    finally:
+        stop.set()
+        if pool is not None:
+            pool.terminate()
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("queue", help="file:<directory> or socket:<host>:<port>")
+    parser.add_argument("--batch", type=int, default=4, help="tasks taken at a time")
+    parser.add_argument("--processes", type=int, default=1)
+    parser.add_argument("--idle", type=float, help="stop after so many seconds without tasks")
+    parser.add_argument("--key-file", help="file holding the secret key of a socket queue, by default "
+                                           "${} or the file ${}".format(KEY_ENV, KEY_FILE_ENV))
+    args = parser.parse_args()
+
+    queue = open_queue(args.queue, worker=True, key_file=args.key_file)
+    count = work(queue, batch=args.batch, processes=args.processes, idle=args.idle)
+    print("{} tasks run".format(count))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import numpy as np
+
+# Lattices of the models as 2-D arrays of small integer codes, and the binary frames in which they are streamed.
+#
+# Every frame starts with a header of four little-endian uint32: kind, step and two numbers depending on kind.
+#   KEY    rows, cols, then rows * cols bytes - the whole lattice, one code per cell, row by row
+#   BITS   rows, cols, then the lattice of a two-state model packed 8 cells per byte (np.packbits)
+#   DELTA  number of runs n, 0, then n uint32 starts, n uint32 lengths (in cells of the flattened lattice)
+#          and the new codes of the changed cells, run after run
+# The header keeps the uint32 arrays aligned, so a client can view them in place.
+
+KEY, BITS, DELTA = 0, 1, 2
+
+# colours of the codes, as in agent_portrayal; a cell without a tree is drawn as the empty canvas
+FIRE_COLOURS = ["white", "green", "red", "black"]  # NO_TREE, OCCUPIED, BURNING, EMPTY (see fireLattice)
+LIFE_COLOURS = ["white", "black"]  # Cell.DEAD, Cell.ALIVE
+
+
+def lattice_of(model):
+    # current state of a ForestFireModel (either variant) or of a GameOfLife as a 2-D uint8 array of codes
+    if hasattr(model, "cells"):
+        return model.cells
+    if model.backend != "agents":
+        return model.lattice
+    return model.to_lattice()
+
+
+def _header(kind, step, a, b):
+    return np.array([kind, step, a, b], dtype="<u4").tobytes()
+
+
+def encode_key(lattice, step, colours=None):
+    # whole lattice; two-state lattices (colours with 2 entries) are bit-packed
+    rows, cols = lattice.shape
+    if colours is not None and len(colours) == 2:
+        return _header(BITS, step, rows, cols) + np.packbits(lattice.ravel() != 0).tobytes()
+    return _header(KEY, step, rows, cols) + np.ascontiguousarray(lattice, dtype=np.uint8).tobytes()
+
+
+def encode_delta(old, new, step, colours=None):
+    """
+    Cells which changed from old to new, as runs of consecutive cells of the flattened lattice.
+
+    If the delta would not be smaller than a key frame (e.g. the first steps of a random Life board),
+    the key frame is returned instead.
+    """
+    flat = new.ravel()
+    changed = np.flatnonzero(old.ravel() != flat)
+    breaks = np.flatnonzero(np.diff(changed) != 1) + 1
+    starts = changed[np.concatenate(([0], breaks))] if len(changed) else changed
+    ends = changed[np.concatenate((breaks - 1, [len(changed) - 1]))] + 1 if len(changed) else changed
+    two_state = colours is not None and len(colours) == 2
+    if 8 * len(starts) + len(changed) >= ((flat.size + 7) // 8 if two_state else flat.size):
+        return encode_key(new, step, colours)
+    return (_header(DELTA, step, len(starts), 0) + starts.astype("<u4").tobytes()
+            + (ends - starts).astype("<u4").tobytes() + flat[changed].astype(np.uint8).tobytes())
+
+
+def decode(message, lattice=None):
+    """
+    Apply a frame to lattice (in place for a delta), as the browser client does.
+
+    :return: (step, lattice)
+    """
+    kind, step, a, b = np.frombuffer(message, dtype="<u4", count=4)
+    body = np.frombuffer(message, dtype=np.uint8, offset=16)
+    if kind == KEY:
+        return int(step), body.reshape(a, b).copy()
+    if kind == BITS:
+        return int(step), np.unpackbits(body, count=a * b).reshape(a, b)
+    starts = body[:4 * a].view("<u4")
+    lengths = body[4 * a:8 * a].view("<u4")
+    values = body[8 * a:]
+    flat = lattice.reshape(-1)
+    offsets = np.cumsum(lengths, dtype=np.int64) - lengths  # position of the first value of every run
+    cells = np.repeat(starts.astype(np.int64) - offsets, lengths) + np.arange(len(values))
+    flat[cells] = values
+    return int(step), lattice
@@ -0,0 +1,219 @@
+"""
+Headless rendering of the forest fire models (without and with wind) and of the Game of Life.
+
+    python viewer/render.py fire --L 2000 --p 0.6 --every 10 --output frames
+    python viewer/render.py wind --L 2000 --p 0.6 --direction 1 1 --strength 0.5 --output fire.mp4
+    python viewer/render.py life --size 1024 --every 1 --output life
+
+The lattice is mapped to colours by a lookup table, in the colours of agent_portrayal (see frames), one pixel
+per cell; no portrayals or figures are made. Frames are written as PNG files into a directory, or, for an
+.mp4/.mkv/.webm output, piped into ffmpeg as one streamed video (needs ffmpeg on the PATH).
+"""
+import argparse
+import os
+import shutil
+import struct
+import subprocess
+import sys
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for directory in [("list1",), ("list1", "ForestFire"), ("list1", "ForestFireWind"), ("list 3",)]:
+    sys.path.append(os.path.join(ROOT, *directory))
+
+import numpy as np
+from PIL import ImageColor
+from frames import FIRE_COLOURS, LIFE_COLOURS, lattice_of
+
+VIDEO = (".mp4", ".mkv", ".webm")
+
+
+def palette(colours):
+    # RGB of every code, one row per code
+    return np.array([ImageColor.getrgb(colour) for colour in colours], dtype=np.uint8)
+
+
+def to_rgb(lattice, colours):
+    # rows x cols x 3 uint8 image of a lattice of codes
+    return np.take(palette(colours), lattice, axis=0)
+
+
+def to_rgba(lattice, colours):
+    # rows x cols x 4 uint8 image, one uint32 lookup per cell (quicker than to_rgb)
+    table = np.zeros((len(colours), 4), dtype=np.uint8)
+    table[:, :3] = palette(colours)
+    table[:, 3] = 255
+    return np.take(table.view(np.uint32).ravel(), lattice).view(np.uint8).reshape(lattice.shape + (4,))
+
+
+def pack_rows(lattice, depth):
+    # rows of the lattice packed depth bits per cell, the first cell in the highest bits (as in PNG)
+    per = 8 // depth
+    rows, cols = lattice.shape
+    if cols % per:
+        padded = np.zeros((rows, cols + per - cols % per), dtype=np.uint8)
+        padded[:, :cols] = lattice
+        lattice = padded
+    groups = lattice.reshape(rows, -1, per)
+    packed = np.zeros(groups.shape[:2], dtype=np.uint8)
+    for k in range(per):
+        packed |= groups[..., k] << (8 - depth * (k + 1))
+    return packed
+
+
+def _chunk(kind, data):
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def write_png(path, lattice, colours, level=1):
+    """
+    Write a lattice of codes as a palette PNG with as few bits per cell as the colours need.
+
+    A forest (4 codes) takes 2 bits per cell and a Life board 1 bit, so there is 4 or 8 times less to
+    compress than in an 8 bit image; at L=2000 a frame takes about 40 ms.
+    :param level: zlib level, 1 is the quickest which still compresses
+    """
+    depth = next(depth for depth in (1, 2, 4, 8) if len(colours) <= 1 << depth)
+    rows, cols = lattice.shape
+    packed = pack_rows(np.asarray(lattice, dtype=np.uint8), depth)
+    scanlines = np.zeros((rows, packed.shape[1] + 1), dtype=np.uint8)  # filter type 0 before every row
+    scanlines[:, 1:] = packed
+    with open(path, "wb") as png:
+        png.write(b"\x89PNG\r\n\x1a\n")
+        png.write(_chunk(b"IHDR", struct.pack(">IIBBBBB", cols, rows, depth, 3, 0, 0, 0)))
+        png.write(_chunk(b"PLTE", palette(colours).tobytes()))
+        png.write(_chunk(b"IDAT", zlib.compress(scanlines.tobytes(), level)))
+        png.write(_chunk(b"IEND", b""))
+
+
+class FrameWriter:
+    """
+    Writes every k-th step of a model as a frame, while the model goes on stepping.
+
+    Frames are encoded in a background thread (zlib and the pipe release the GIL), at most one frame
+    behind the model, so a run is slowed down only when encoding a frame takes longer than k steps
+    (see write_png).
+    """
+
+    def __init__(self, path, colours, every=1, fps=25):
+        """
+        :param path: directory of PNG frames (frame-000000.png, ... by step), or a video file (see VIDEO)
+        :param colours: colour of every code of the lattice, e.g. frames.FIRE_COLOURS
+        :param every: write the steps which are multiples of every
+        :param fps: frames per second of a video
+        """
+        self.path = path
+        self.colours = colours
+        self.every = every
+        self.fps = fps
+        self.video = os.path.splitext(path)[1].lower() in VIDEO
+        self.ffmpeg = None
+        self.pending = None
+        self.frames = 0
+        self.encoder = ThreadPoolExecutor(1)
+        if not self.video:
+            os.makedirs(path, exist_ok=True)
+        elif shutil.which("ffmpeg") is None:
+            raise ValueError("Writing " + str(path) + " needs ffmpeg, write PNG frames into a directory instead")
+
+    def __call__(self, model):
+        # write the current step of the model, if it is one of every k-th
+        step = model.schedule.steps
+        if step % self.every == 0:
+            self.write(lattice_of(model).copy(), step)
+
+    def write(self, lattice, step):
+        if self.pending is not None:
+            self.pending.result()  # at most one frame waits, the lattice copies do not pile up
+        self.pending = self.encoder.submit(self._encode, lattice, step)
+        self.frames += 1
+
+    def _encode(self, lattice, step):
+        if not self.video:
+            write_png(os.path.join(self.path, "frame-{:06d}.png".format(step)), lattice, self.colours)
+            return
+        if self.ffmpeg is None:
+            rows, cols = lattice.shape
+            self.ffmpeg = subprocess.Popen(
+                ["ffmpeg", "-loglevel", "error", "-y", "-f", "rawvideo", "-pix_fmt", "rgba",
+                 "-s", "{}x{}".format(cols, rows), "-r", str(self.fps), "-i", "-",
+                 "-vf", "pad=ceil(iw/2)*2:ceil(ih/2)*2", "-pix_fmt", "yuv420p", self.path],
+                stdin=subprocess.PIPE)
+        self.ffmpeg.stdin.write(to_rgba(lattice, self.colours).tobytes())
+
+    def close(self):
+        if self.pending is not None:
+            self.pending.result()
+        self.encoder.shutdown()
+        if self.ffmpeg is not None:
+            self.ffmpeg.stdin.close()
+            self.ffmpeg.wait()
+            self.ffmpeg = None
+
+
+def render_run(model, path, colours, every=1, max_steps=None, fps=25):
+    """
+    Step the model until it stops (or max_steps), writing every k-th step with a FrameWriter.
+
+    The first and the last step are written as well.
+    :return: number of frames written
+    """
+    writer = FrameWriter(path, colours, every, fps)
+    try:
+        writer(model)
+        while model.running and (max_steps is None or model.schedule.steps < max_steps):
+            model.step()
+            writer(model)
+        if model.schedule.steps % every != 0:
+            writer.write(lattice_of(model).copy(), model.schedule.steps)
+    finally:
+        writer.close()
+        model.close()
+    return writer.frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+    fire = commands.add_parser("fire", help="forest fire without wind")
+    wind = commands.add_parser("wind", help="forest fire with wind")
+    life = commands.add_parser("life", help="Game of Life")
+    for command in (fire, wind):
+        command.add_argument("--L", type=int, default=2000)
+        command.add_argument("--p", type=float, default=0.6)
+        command.add_argument("--seed", type=int)
+        command.add_argument("--backend", default="numpy", help="numpy or jit (with numba)")
+    wind.add_argument("--direction", type=int, nargs=2, default=[1, 1])
+    wind.add_argument("--strength", type=float, default=0.5)
+    life.add_argument("--size", type=int, default=1024)
+    life.add_argument("--backend", default="bits")
+    for command in (fire, wind, life):
+        command.add_argument("--output", required=True, help="directory of PNG frames, or a video file")
+        command.add_argument("--every", type=int, default=1, help="write every k-th step")
+        command.add_argument("--max-steps", type=int)
+        command.add_argument("--fps", type=int, default=25)
+        command.add_argument("--processes", type=int, default=1)
+    args = parser.parse_args()
+
+    if args.command == "fire":
+        from ForestFireModel import ForestFireModel
+        model = ForestFireModel(args.L, args.p, backend=args.backend, seed=args.seed, processes=args.processes)
+        colours = FIRE_COLOURS
+    elif args.command == "wind":
+        from ForestFireWind import ForestFireModel
+        model = ForestFireModel(args.L, args.p, tuple(args.direction), args.strength, backend=args.backend,
+                                seed=args.seed, processes=args.processes)
+        colours = FIRE_COLOURS
+    else:
+        from gameOfLife import GameOfLife
+        model = GameOfLife(args.size, args.size, backend=args.backend, processes=args.processes)
+        colours = LIFE_COLOURS
+    if args.max_steps is None and args.command == "life":
+        args.max_steps = 1000  # a Life board need not stop
+    frames = render_run(model, args.output, colours, args.every, args.max_steps, args.fps)
+    print("{} frames of {} steps written to {}".format(frames, model.schedule.steps, args.output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+import asyncio
+import json
+import os
+import tornado.ioloop
+import tornado.web
+import tornado.websocket
+from frames import encode_delta, encode_key, lattice_of
+
+# Live view of big lattices: the model is stepped on its own asyncio task and every client gets the whole
+# lattice once (see frames.encode_key) and then only the runs of cells changed since the last frame it got.
+
+PAGE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "stream.html")
+
+
+class StreamServer:
+    """
+    Visualisation server sending the lattice as binary frames instead of ModularServer's portrayals.
+
+    The model steps as fast as it can (or every interval seconds) whatever the clients do. A client is sent
+    the latest lattice when it has drawn the previous frame, so a slow client skips frames instead of
+    slowing the model down or queueing them. Like ModularServer: set port, then launch().
+    """
+
+    def __init__(self, model_cls, model_params, colours, name="Model", interval=0.0):
+        """
+        :param model_cls: ForestFireModel (either variant) or GameOfLife
+        :param model_params: kwargs of the model, the numpy (or bits) backend keeps up with big lattices
+        :param colours: colour of every code of the lattice, e.g. frames.FIRE_COLOURS
+        :param interval: least number of seconds between steps
+        """
+        self.model_cls = model_cls
+        self.model_params = model_params
+        self.colours = colours
+        self.name = name
+        self.interval = interval
+        self.port = 8521
+        self.model = None
+        self.frame = None  # (step, lattice) of the latest step, a copy the model does not touch any more
+        self.clients = set()
+        self.paused = False
+        self.restart = True  # build a new model before the next step
+        self.wake = None  # set to resume stepping (play, reset)
+
+    def launch(self, port=None):
+        if port is not None:
+            self.port = port
+        application = tornado.web.Application([(r"/", PageHandler, {"server": self}),
+                                               (r"/ws", FrameHandler, {"server": self})])
+        application.listen(self.port)
+        print("Interface starting at http://127.0.0.1:{}".format(self.port))
+        tornado.ioloop.IOLoop.current().add_callback(self.run)
+        tornado.ioloop.IOLoop.current().start()
+
+    def publish(self, step, lattice):
+        self.frame = (step, lattice)
+        for client in self.clients:
+            client.fresh.set()
+
+    def reset(self):
+        self.restart = True
+        self.paused = False
+        self.wake.set()
+
+    def _start(self):
+        # build the model, return its first frame (in a worker thread, like _step)
+        if self.model is not None:
+            self.model.close()
+        self.model = self.model_cls(**self.model_params)
+        return self.model.schedule.steps, lattice_of(self.model).copy()
+
+    def _step(self):
+        self.model.step()
+        return self.model.schedule.steps, lattice_of(self.model).copy()
+
+    async def run(self):
+        # stepping task: the model steps in a worker thread, so the event loop keeps serving the clients
+        loop = asyncio.get_running_loop()
+        self.wake = asyncio.Event()
+        while True:
+            if self.restart:
+                self.restart = False
+                self.publish(*await loop.run_in_executor(None, self._start))
+            if self.paused or not self.model.running:
+                self.wake.clear()
+                await self.wake.wait()
+                continue
+            started = loop.time()
+            self.publish(*await loop.run_in_executor(None, self._step))
+            await asyncio.sleep(max(0.0, self.interval - (loop.time() - started)))
+
+
+class PageHandler(tornado.web.RequestHandler):
+
+    def initialize(self, server):
+        self.server = server
+
+    def get(self):
+        with open(PAGE) as page:
+            html = page.read()
+        self.write(html.replace("{{ name }}", self.server.name)
+                   .replace("{{ colours }}", json.dumps(self.server.colours)))
+
+
+class FrameHandler(tornado.websocket.WebSocketHandler):
+    """
+    One client: a key frame first, then deltas from the last frame sent.
+
+    The client answers every frame with "ack" once it is drawn; until then newer frames only replace each
+    other, and the next delta is taken from the last frame sent to the latest one.
+    """
+
+    def initialize(self, server):
+        self.server = server
+        self.fresh = asyncio.Event()  # a frame newer than the last one sent
+        self.drawn = asyncio.Event()  # the client drew the last frame
+        self.sender = None
+
+    def open(self):
+        self.set_nodelay(True)
+        self.server.clients.add(self)
+        self.drawn.set()
+        if self.server.frame is not None:
+            self.fresh.set()
+        self.sender = asyncio.ensure_future(self.send_frames())
+
+    async def send_frames(self):
+        sent = None  # lattice the client has
+        try:
+            while True:
+                await self.fresh.wait()
+                await self.drawn.wait()
+                self.fresh.clear()
+                self.drawn.clear()
+                step, lattice = self.server.frame
+                if sent is None or sent.shape != lattice.shape:
+                    message = encode_key(lattice, step, self.server.colours)
+                else:
+                    message = encode_delta(sent, lattice, step, self.server.colours)
+                await self.write_message(message, binary=True)  # waits until the socket takes it
+                sent = lattice
+        except tornado.websocket.WebSocketClosedError:
+            pass
+
+    def on_message(self, message):
+        if message == "ack":
+            self.drawn.set()
+        elif message == "pause":
+            self.server.paused = True
+        elif message == "play":
+            self.server.paused = False
+            self.server.wake.set()
+        elif message == "reset":
+            self.server.reset()
+
+    def on_close(self):
+        self.server.clients.discard(self)
+        if self.sender is not None:
+            self.sender.cancel()